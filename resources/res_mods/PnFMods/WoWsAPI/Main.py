@@ -2,6 +2,32 @@ API_VERSION = "API_v1.0"
 MOD_NAME = "WoWsAPI"
 MOD_PATH = utils.getModDir()
 DATA_PATH = MOD_PATH + "/../../game_data.json"
+LOG_FLUSH_INTERVAL = 2  # seconds between log flushes
+LOG_FLUSH_SIZE = 64  # buffered lines to flush immediately
+LOG_MAX_SIZE = 1 << 22  # bytes of runtime.log before rotating
+FLUSH_INTERVAL = 1  # seconds between journal flushes
+FLUSH_SIZE = 64  # pending keys to flush immediately
+COMPACT_SIZE = 1024  # journal records to compact
+HEARTBEAT_INTERVAL = 5  # seconds between heartbeats telling the bot mod is alive
+SHELL_BUFFER_SIZE = 256  # recent shells kept in ring buffer
+SHELL_PUBLISH_INTERVAL = 2  # seconds between shell stats updates
+PORT_PATH = MOD_PATH + "/../../game_port.txt"  # loopback port of the bot listener, written by the bot
+SEND_INTERVAL = 0  # seconds between sends while connected
+SEND_TIMEOUT = 0.001  # seconds to block in a send
+SEND_BUFFER_SIZE = 1 << 20  # bytes unsent before falling back to the journal
+CONNECT_TIMEOUT = 0.05
+RECONNECT_INTERVAL = 10
+
+try:
+    import socket
+    import struct
+except Exception:
+    socket = None  # client forbids imports, use the journal only
+
+try:
+    import os
+except Exception:
+    os = None  # runtime.log is cleared instead of rotated
 
 damage_types = {1: "damaged",
                 2: "penetration",
@@ -16,36 +42,206 @@ damage_types = {1: "damaged",
 
 
 class Logger:
+    """
+    Buffered logger writing runtime.log
+    Lines are flushed by size or interval, errors immediately,
+    and the file is rotated to runtime.log.1 when it grows too large
+    """
     levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
 
     def __init__(self, level=1):
         self.level = level
         self.log_path = MOD_PATH + "/runtime.log"
+        self.buffer = []
+        self.size = 0  # bytes written to log file
+        self.handle = None  # callback handle of flush timer
         if level == 0:
             devmenu.enable()
 
         time = utils.timeNow()
         game_version = utils.getGameVersion()
+        header = "GameVersion {}, {}".format(game_version, API_VERSION)
+        header += "{}: Mod {} loaded \n on {}".format(time, MOD_NAME, MOD_PATH)
         with open(self.log_path, "w") as f:
-            f.write("GameVersion {}, {}".format(game_version, API_VERSION))
-            f.write("{}: Mod {} loaded \n on {}".format(time, MOD_NAME, MOD_PATH))
+            f.write(header)
+        self.size = len(header)
 
-    def log(self, name, level=1, message=""):
+    def log(self, name, level=1, message="", *args):
+        """Log message formatted with args, messages below level are dropped unformatted"""
         if level < self.level:
             return
         time = utils.timeNow()
-        msg = str(message)
+        msg = message.format(*args) if args else str(message)
         str_level = self.levels[level]
-        utils.logInfo(msg, str_level)
+        if level > 0:
+            utils.logInfo(msg, str_level)
+        self.buffer.append("{}: <{}>[{}]: {} \n".format(time, name, str_level, msg))
+        if len(self.buffer) >= LOG_FLUSH_SIZE or level >= 3:
+            self.flush()
+        elif self.handle is None:
+            self.handle = callbacks.callback(LOG_FLUSH_INTERVAL, self.on_timer)
+
+    def on_timer(self):
+        self.handle = None
+        self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        text = "".join(self.buffer)
+        self.buffer = []
+        if self.size + len(text) > LOG_MAX_SIZE:
+            self.rotate()
         with open(self.log_path, "a") as f:
-            f.write("{}: <{}>[{}]: {} \n".format(time, name, str_level, msg))
+            f.write(text)
+        self.size += len(text)
+
+    def rotate(self):
+        """Rename current log to runtime.log.1 and start a new one"""
+        backup = self.log_path + ".1"
+        try:
+            if utils.isFile(backup):
+                os.remove(backup)  # rename does not replace a file on windows
+            os.rename(self.log_path, backup)
+        except Exception:
+            with open(self.log_path, "w") as f:
+                pass
+        self.size = 0
+
+
+def read_port():
+    """Port of the bot listener of this game, 0 if the bot disabled it"""
+    if not utils.isFile(PORT_PATH):
+        return 0
+    try:
+        with open(PORT_PATH, "r") as f:
+            return int(f.read().strip() or 0)
+    except Exception:
+        return 0
+
+
+class Publisher:
+    """
+    Stream game data records to the bot listener on loopback
+    Each record is utf-8 json prefixed by its 4-byte big-endian length in bytes
+    Nothing is tried while the bot has no listener, see check
+    """
+
+    def __init__(self, on_connect=None, on_disconnect=None):
+        self.sock = None
+        self.retry = None  # callback handle of reconnect
+        self.buffer = b""  # framed records not sent yet
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+
+    def connect(self):
+        self.retry = None
+        if socket is None or self.sock is not None:
+            return
+        port = read_port()
+        if not port:
+            return  # listener disabled, journal only
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(("127.0.0.1", port))
+        except Exception:
+            sock.close()
+            self.reconnect()
+            return
+        sock.settimeout(SEND_TIMEOUT)
+        self.sock = sock
+        self.buffer = b""
+        if self.on_connect:
+            self.on_connect()
+
+    def disconnect(self):
+        if self.sock is None:
+            return
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+        self.sock = None
+        self.buffer = b""
+        if self.on_disconnect:
+            self.on_disconnect()
+        self.reconnect()
+
+    def reconnect(self):
+        if self.retry is None:
+            self.retry = callbacks.callback(RECONNECT_INTERVAL, self.connect)
+
+    def check(self):
+        """Connect if the bot started a listener since, called on heartbeat"""
+        if socket is not None and self.sock is None and self.retry is None:
+            self.connect()
+
+    def send(self, lines):
+        """Queue lines and send as much as the socket takes, return False if disconnected"""
+        if self.sock is None:
+            return False
+        for line in lines:
+            if not isinstance(line, bytes):
+                line = line.encode("utf-8")  # jsonEncode may return unicode, length counts bytes
+            self.buffer += struct.pack(">I", len(line)) + line
+        if len(self.buffer) > SEND_BUFFER_SIZE:
+            self.disconnect()  # bot does not keep up
+            return False
+        try:
+            sent = self.sock.send(self.buffer)
+            self.buffer = self.buffer[sent:]
+        except socket.timeout:
+            pass  # socket buffer full, retry on next flush
+        except Exception:
+            self.disconnect()
+            return False
+        return True
 
 
 class GameData:
+    """
+    Game data kept in memory and journaled to DATA_PATH
+    Each line of the journal is a json record, the first one is {"epoch": ...}
+    and the others are {"k": key, "v": value} to apply in order
+    Epochs are the time and a counter going on from the loaded journal,
+    so they differ even when written within one clock tick or after a restart
+    While the bot listener is connected, the same records are streamed to it
+    instead, and the journal is compacted to catch up when it disconnects
+    """
 
     def __init__(self):
+        self.data = {}
+        self.pending = {}  # key -> value not flushed yet
+        self.records = 0  # records in journal
+        self.epochs = 0  # counter of the last epoch written
+        self.handle = None  # callback handle of flush timer
+        self.publisher = Publisher(on_connect=self.on_connect, on_disconnect=self.compact)
+        self.load()
+        self.compact()
+        self.publisher.connect()
+
+    def load(self):
+        if not utils.isFile(DATA_PATH):
+            return
         with open(DATA_PATH, "r") as f:
-            self.data = utils.jsonDecode(f.read())
+            for line in f:
+                try:
+                    record = utils.jsonDecode(line)
+                except Exception:
+                    continue  # partial line
+                if "k" in record:
+                    self.data[record["k"]] = record.get("v")
+                elif "epoch" in record:
+                    _, sep, count = str(record["epoch"]).rpartition("#")
+                    if sep and count.isdigit():
+                        self.epochs = int(count)
+                else:
+                    self.data.update(record)  # legacy whole-file data
+
+    def new_epoch(self):
+        self.epochs += 1
+        return "{}#{}".format(utils.timeNow(), self.epochs)
 
     def get(self, key, default=None):
         if key in self.data:
@@ -55,8 +251,103 @@ class GameData:
 
     def update(self, key, value):
         self.data[key] = value
+        self.pending[key] = value
+        if len(self.pending) >= FLUSH_SIZE:
+            self.flush()
+        else:
+            self.schedule()
+
+    def schedule(self):
+        if self.handle is None:
+            interval = SEND_INTERVAL if self.publisher.sock else FLUSH_INTERVAL
+            self.handle = callbacks.callback(interval, self.on_timer)
+
+    def on_timer(self):
+        self.handle = None
+        self.flush()
+
+    def on_connect(self):
+        lines = [utils.jsonEncode({"epoch": self.new_epoch()})]
+        lines.extend(utils.jsonEncode({"k": k, "v": v}) for k, v in self.data.items())
+        self.pending = {}
+        self.publisher.send(lines)
+
+    def flush(self):
+        if self.publisher.sock:
+            lines = [utils.jsonEncode({"k": k, "v": v}) for k, v in self.pending.items()]
+            self.pending = {}
+            if self.publisher.send(lines) and self.publisher.buffer:
+                self.schedule()  # send the rest later
+            return
+        if not self.pending:
+            return
+        if self.records + len(self.pending) > COMPACT_SIZE:
+            self.compact()
+            return
+        lines = [utils.jsonEncode({"k": k, "v": v}) for k, v in self.pending.items()]
+        self.pending = {}
+        with open(DATA_PATH, "a") as f:
+            f.write("\n".join(lines) + "\n")
+        self.records += len(lines)
+
+    def compact(self):
+        """Rewrite journal as a new epoch with one record per key"""
+        self.pending = {}
+        lines = [utils.jsonEncode({"epoch": self.new_epoch()})]
+        lines.extend(utils.jsonEncode({"k": k, "v": v}) for k, v in self.data.items())
         with open(DATA_PATH, "w") as f:
-            f.write(utils.jsonEncode(self.data))
+            f.write("\n".join(lines) + "\n")
+        self.records = len(lines) - 1
+
+
+class ShellStats:
+    """
+    Shells of a battle kept in a fixed-size ring buffer with running aggregates
+    Aggregates are split into shells dealt and received by self ship
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.shells = [None] * SHELL_BUFFER_SIZE  # no shell of the last battle is "last"
+        self.index = 0
+        self.count = 0
+        self.sides = {"dealt": self._new_side(), "received": self._new_side()}
+
+    @staticmethod
+    def _new_side():
+        return {"shells": 0, "hits": 0, "penetrations": 0, "damage": 0,
+                "damage_by_type": {}}
+
+    def add(self, ship_id, victim_id, shooter_id, ammo_id, mask, damage):
+        self.shells[self.index] = (victim_id, shooter_id, ammo_id, mask, damage)
+        self.index = (self.index + 1) % SHELL_BUFFER_SIZE
+        self.count += 1
+
+        if shooter_id == ship_id:
+            side = self.sides["dealt"]
+        elif victim_id == ship_id:
+            side = self.sides["received"]
+        else:
+            return
+        side["shells"] += 1
+        if not mask:
+            return
+        side["hits"] += 1
+        side["damage"] += damage
+        if (mask >> 2) & 1:
+            side["penetrations"] += 1
+        by_type = side["damage_by_type"]
+        for i, name in damage_types.items():
+            if (mask >> i) & 1:
+                by_type[name] = by_type.get(name, 0) + damage
+
+    def summary(self):
+        return {"count": self.count,
+                "dealt": self.sides["dealt"],
+                "received": self.sides["received"],
+                "last": self.shells[self.index - 1]}
 
 
 class GameStatus:
@@ -66,23 +357,32 @@ class GameStatus:
         self.logger = logger
         self.data = data
         self.handle = None  # callback handle of ship dot
+        self.ship_id = None
+        self.shell_stats = ShellStats()
+        self.shell_handle = None  # callback handle of shell stats publish
 
-        # events.onSFMEvent(self.sfm_event)
+        events.onSFMEvent(self.sfm_event)
         # events.onKeyEvent(self.key_event)
         # events.onMouseEvent(self.mouse_event)
-        # events.onBattleStart(self.battle_start)
-        # events.onBattleEnd(self.battle_end)
-        # events.onBattleQuit(self.battle_quit)
-        # events.onReceiveShellInfo(self.receive_shell_info)
+        events.onBattleStart(self.battle_start)
+        events.onBattleEnd(self.battle_end)
+        events.onBattleQuit(self.battle_quit)
+        events.onReceiveShellInfo(self.receive_shell_info)
         # Not implemented yet
         # events.onGotRibbon(self.got_ribbon)
         # events.onAchievement(self.achievement)
         # events.onBattleStasRecived(self.battle_stas_recived)
         self.logger.log(name=self.name, message="Initialized")
+        self._heartbeat()
+
+    def _heartbeat(self):
+        self.data.update(key="heartbeat", value=str(utils.timeNow()))
+        self.data.publisher.check()
+        callbacks.callback(HEARTBEAT_INTERVAL, self._heartbeat)
 
     def _handle_ship_dot(self, ship_id):
         if battle.isVehicleBurning(ship_id) or battle.isVehicleFloating(ship_id):
-            self.logger.log(name="DOT", message="Ship under DOT")
+            self.logger.log(name="DOT", level=0, message="Ship under DOT")
             self.data.update(key="ship_dot", value=True)
         else:
             self.data.update(key="ship_dot", value=False)
@@ -101,14 +401,14 @@ class GameStatus:
         ship_info = battle.getPlayerShipInfo(self_id)
         self.logger.log(name="SelfShip", message=ship_info)
         self.data.update(key="ship_ship", value=ship_info)
+        self.ship_id = ship_info["id"]
 
         if battle.isBattleStarted() and not self.handle:
             ship_id = ship_info["id"]
             self.handle = callbacks.callback(2, self._handle_ship_dot, ship_id)
 
     def sfm_event(self, event_name, event_data):
-        log_msg = "EventName: {} \nEventData: {}".format(event_name, event_data)
-        self.logger.log(name="Event", message=log_msg)
+        self.logger.log("Event", 0, "EventName: {} \nEventData: {}", event_name, event_data)
 
         if event_name == "window.show":
             window_name = event_data["windowName"]
@@ -124,19 +424,20 @@ class GameStatus:
                      "shift": event.isShiftDown,
                      "ctrl": event.isCtrlDown,
                      "alt": event.isAltDown, }
-        self.logger.log(name="Key", message=event_key)
+        self.logger.log(name="Key", level=0, message=event_key)
         self.data.update("keyboard", event_key)
 
     def mouse_event(self, event):
         event_mouse = {"dx": event.dx,
                        "dy": event.dy,
                        "dz": event.dz, }
-        self.logger.log(name="Mouse", message=event_mouse)
+        self.logger.log(name="Mouse", level=0, message=event_mouse)
         self.data.update("mouse", event_mouse)
 
     def battle_start(self):
         self.logger.log(name="Battle", message="Battle Start")
         self.data.update(key="battle_status", value="start")
+        self.shell_stats.reset()
         self._handle_battle()
 
     def battle_end(self):
@@ -146,27 +447,24 @@ class GameStatus:
             callbacks.cancel(self.handle)
 
     def battle_quit(self, arg):
-        self.logger.log(name="Battle", message="Battle Quit with {}".format(arg))
+        self.logger.log("Battle", 1, "Battle Quit with {}", arg)
         self.data.update(key="battle_status", value="quit")
         if self.handle:
             callbacks.cancel(self.handle)
 
     def receive_shell_info(self, *args, **kwargs):
-        shell_info = {"victim_id": args[0],
-                      "shooter_id": args[1],
-                      "ammo_id": (args[2]),
-                      "mat_id": args[3],
-                      "shoot_id": args[4],
-                      "damage_type": [damage_types[i] for i in damage_types.keys()
-                                      if (args[5] >> i) & 1],
-                      "damage": args[6],
-                      "shot_position": list(args[7]),
-                      "yaw": args[8],
-                      "hlinfo": list(args[9]), }
-        self.logger.log(name="Shell", message=shell_info)
-        self.data.update(key="shell_info", value=shell_info)
-
-
-logger = Logger(level=0)
+        # args: victim_id, shooter_id, ammo_id, mat_id, shoot_id, damage_type mask,
+        # damage, shot_position, yaw, hlinfo
+        self.logger.log("Shell", 0, "{}", args)
+        self.shell_stats.add(self.ship_id, args[0], args[1], args[2], args[5], args[6])
+        if self.shell_handle is None:
+            self.shell_handle = callbacks.callback(SHELL_PUBLISH_INTERVAL, self._publish_shell_stats)
+
+    def _publish_shell_stats(self):
+        self.shell_handle = None
+        self.data.update(key="shell_stats", value=self.shell_stats.summary())
+
+
+logger = Logger(level=1)  # 0 also logs every event, shell and devmenu
 data = GameData()
-# game_status = GameStatus(logger=logger, data=data)
\ No newline at end of file
+game_status = GameStatus(logger=logger, data=data)
\ No newline at end of file
@@ -1,12 +1,325 @@
 
+import hashlib
 import json
+import logging
 import os
 import re
 import shutil
+import socket
+import struct
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class ModDataReader:
+    """
+    Incremental reader of the mod journal
+    Keeps merged data in memory and only parses records appended since last poll
+    """
+
+    def __init__(self, path: str, interval: float = 0.05):
+        self.path = path
+        self.interval = interval  # min seconds between polls in get
+        self.data: dict = {}
+        self.epoch = None
+        self.offset = 0  # bytes of journal already applied
+        self.stat: tuple[int, int] | None = None  # (mtime_ns, size) last seen
+        self.polled = 0.0  # time of last poll
+        self.updated = 0.0  # time when data last changed
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _parse(line: bytes) -> dict:
+        try:
+            record = json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return {}  # partial or broken line
+        return record if isinstance(record, dict) else {}
+
+    def poll(self) -> set[str]:
+        """Apply newly appended records and return changed keys"""
+        with self.lock:
+            self.polled = time.monotonic()
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                return set()
+            stat = (st.st_mtime_ns, st.st_size)
+            if stat == self.stat:
+                return set()
+
+            with open(self.path, "rb") as f:
+                header = f.readline()
+                epoch = self._parse(header).get("epoch")
+                old = None
+                if epoch != self.epoch or st.st_size < self.offset:
+                    # journal was compacted into a new epoch, read from start
+                    old = self.data
+                    self.data = {}
+                    self.epoch = epoch
+                    self.offset = len(header) if epoch is not None else 0
+                f.seek(self.offset)
+                chunk = f.read()
+
+            # apply complete lines only, the rest is read on next poll
+            end = chunk.rfind(b"\n") + 1
+            self.offset += end
+            self.stat = stat if end == len(chunk) else None
+            changed = set()
+            for line in chunk[:end].splitlines():
+                record = self._parse(line)
+                if "k" not in record:
+                    continue
+                key, value = record["k"], record.get("v")
+                if key not in self.data or self.data[key] != value:
+                    changed.add(key)
+                self.data[key] = value
+
+            if old is not None:
+                keys = self.data.keys() | old.keys()
+                changed = {k for k in keys if k not in self.data or k not in old
+                           or self.data[k] != old[k]}
+            if changed:
+                self.updated = time.monotonic()
+            return changed
+
+    def get(self, key: str, default=None):
+        """Get value of key, polling the journal at most once per interval"""
+        if time.monotonic() - self.polled >= self.interval:
+            self.poll()
+        return self.data.get(key, default)
+
+    def wait_for_change(self, keys: list[str] | None = None, timeout: float | None = None) -> set[str]:
+        """Block until any of keys (or any key if empty) changes, return changed keys"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = self.poll()
+            if keys:
+                changed &= set(keys)
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval)
+
+
+class ModListener:
+    """
+    Loopback listener of game data streamed by the mod
+    Messages are json records prefixed by a 4-byte big-endian length, the same
+    records as in the mod journal. The mod reconnects whenever the connection drops,
+    each connection is served in its own thread so a new one never waits behind an old one
+    """
+
+    max_size = 1 << 24  # max bytes of a message
+
+    def __init__(self, port: int, host: str = "127.0.0.1"):
+        self.host = host
+        self.port = port
+        self.data: dict = {}
+        self.epoch = None
+        self.live: set[int] = set()  # ids of connections being served
+        self.sources: dict[str, int] = {}  # id of connection that sent each key
+        self.accepted = 0  # connections accepted so far, also next id
+        self.updated = 0.0  # time when data last changed
+        self.version = 0  # increased on every change
+        self.versions: dict[str, int] = {}  # version of last change per key
+        self.polled = 0  # version of last poll
+        self.cond = threading.Condition()
+        self.stop_event = threading.Event()
+        self.server: socket.socket | None = None
+        self.thread: threading.Thread | None = None
+
+    @property
+    def connected(self) -> bool:
+        return bool(self.live)
+
+    def start(self):
+        self.server = socket.create_server((self.host, self.port))
+        self.server.settimeout(1)
+        self.port = self.server.getsockname()[1]  # bound port if 0 was given
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+        log.info(f"Listening mod data on {self.host}:{self.port}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.server is not None:
+            self.server.close()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+
+    def _serve(self):
+        while not self.stop_event.is_set():
+            try:
+                conn, addr = self.server.accept()  # type: ignore
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.accepted += 1
+            threading.Thread(target=self._handle, args=(conn, addr, self.accepted), daemon=True).start()
+
+    def _handle(self, conn: socket.socket, addr: tuple, source: int):
+        log.info(f"Mod connected from {addr}")
+        with self.cond:
+            self.live.add(source)
+        try:
+            self._receive(conn, source)
+        except (OSError, ValueError) as e:
+            log.warning(f"Mod connection lost, {e}")
+        finally:
+            with self.cond:
+                self.live.discard(source)
+            conn.close()
+
+    def _recv_exact(self, conn: socket.socket, size: int) -> bytes | None:
+        """Receive exactly size bytes, None if closed or stopped"""
+        buf = bytearray()
+        while len(buf) < size:
+            if self.stop_event.is_set():
+                return None
+            try:
+                chunk = conn.recv(size - len(buf))
+            except socket.timeout:
+                continue
+            if not chunk:
+                return None
+            buf.extend(chunk)
+        return bytes(buf)
+
+    def _receive(self, conn: socket.socket, source: int):
+        conn.settimeout(1)
+        while True:
+            head = self._recv_exact(conn, 4)
+            if head is None:
+                return
+            size = struct.unpack(">I", head)[0]
+            if size > self.max_size:
+                raise ValueError(f"Message of {size} bytes too large")
+            payload = self._recv_exact(conn, size)
+            if payload is None:
+                return
+            self.apply(json.loads(payload), source)
+
+    def apply(self, record: dict, source: int = 0):
+        """Apply a record received from connection source to data"""
+        with self.cond:
+            if "epoch" in record:
+                # a new session sends its whole data after the epoch, keys of the old
+                # session are dropped and reported as changed until it arrives
+                self.epoch = record["epoch"]
+                dropped = [k for k, s in self.sources.items() if s == source or s not in self.live]
+                if dropped:
+                    self.version += 1
+                    for key in dropped:
+                        self.data.pop(key, None)
+                        del self.sources[key]
+                        self.versions[key] = self.version
+                    self.updated = time.monotonic()
+                    self.cond.notify_all()
+                return
+            if "k" not in record:
+                return
+            key, value = record["k"], record.get("v")
+            self.sources[key] = source
+            if key in self.data and self.data[key] == value:
+                return
+            self.data[key] = value
+            self.version += 1
+            self.versions[key] = self.version
+            self.updated = time.monotonic()
+            self.cond.notify_all()
+
+    def poll(self) -> set[str]:
+        """Return keys changed since last poll"""
+        with self.cond:
+            changed = {k for k, v in self.versions.items() if v > self.polled}
+            self.polled = self.version
+            return changed
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+    def wait_for_change(self, keys: list[str] | None = None, timeout: float | None = None) -> set[str]:
+        """Block until any of keys (or any key if empty) changes, return changed keys"""
+        with self.cond:
+            start = self.version
+
+            def changed() -> set[str]:
+                return {k for k, v in self.versions.items()
+                        if v > start and (not keys or k in keys)}
+
+            self.cond.wait_for(changed, timeout)
+            return changed()
+
+
+class ModPublisher:
+    """
+    Stand-in of the mod publishing game data to a ModListener, to test without the game
+    Pending values are coalesced by key, so a slow listener never makes it queue up
+    """
+
+    def __init__(self, port: int, host: str = "127.0.0.1", reconnect_interval: float = 1,
+                 heartbeat_interval: float = 5):
+        self.host = host
+        self.port = port
+        self.reconnect_interval = reconnect_interval
+        self.heartbeat_interval = heartbeat_interval  # like the mod, also detects lost listener
+        self.data: dict = {}
+        self.pending: dict = {}
+        self.cond = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+
+    def publish(self, key: str, value):
+        with self.cond:
+            self.data[key] = value
+            self.pending[key] = value
+            self.cond.notify_all()
+
+    @staticmethod
+    def _frame(record: dict) -> bytes:
+        payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        return struct.pack(">I", len(payload)) + payload
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                with socket.create_connection((self.host, self.port), timeout=1) as conn:
+                    # a new session starts with epoch and whole data
+                    with self.cond:
+                        records = [{"epoch": str(time.time())}]
+                        records.extend({"k": k, "v": v} for k, v in self.data.items())
+                        self.pending = {}
+                    conn.sendall(b"".join(self._frame(r) for r in records))
+                    while not self.stop_event.is_set():
+                        with self.cond:
+                            if not self.cond.wait_for(lambda: self.pending or self.stop_event.is_set(),
+                                                      self.heartbeat_interval):
+                                self.data["heartbeat"] = self.pending["heartbeat"] = time.time()
+                            pending, self.pending = self.pending, {}
+                        conn.sendall(b"".join(self._frame({"k": k, "v": v})
+                                              for k, v in pending.items()))
+            except OSError:
+                self.stop_event.wait(self.reconnect_interval)
 
 
 class ApiCaller:
-    def __init__(self, gamepath: str):
+    def __init__(self, gamepath: str, port: int = 0):
         self.data = None
         self.resource_path = "resources"
         self.modpath = os.path.join(gamepath, "res_mods")
@@ -16,6 +329,32 @@ class ApiCaller:
         else:
             raise FileNotFoundError("res_mod not found in game path")
         self.data_path = os.path.join(self.target, "game_data.json")
+        self.port_path = os.path.join(self.target, "game_port.txt")  # read by the mod to connect
+        self.reader = ModDataReader(self.data_path)
+        self.listener: ModListener | None = None
+        if port:
+            self.listener = self.start_listener(port)
+        self.write_port(self.listener.port if self.listener else 0)
+
+    @staticmethod
+    def start_listener(port: int) -> ModListener | None:
+        """Listen on port, or on a free port if another instance holds it"""
+        for p in (port, 0):
+            try:
+                listener = ModListener(port=p)
+                listener.start()
+                return listener
+            except OSError as e:
+                log.warning(f"Mod listener on port {p or 'any'} not started, {e}")
+        return None
+
+    def write_port(self, port: int):
+        """Tell the mod of this game where to connect, 0 to keep it on the journal"""
+        try:
+            with open(self.port_path, "w", encoding="utf-8") as f:
+                f.write(str(port))
+        except OSError as e:
+            log.warning(f"Failed to write {self.port_path}, {e}")
 
     def find_target(self) -> str | None:
         """Finds the target path in the max num path"""
@@ -41,22 +380,86 @@ class ApiCaller:
 
         return target
 
-    def deploy_mod(self):
-        """deploy mod folder to target"""
+    @staticmethod
+    def _hash_file(path: str) -> str:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _is_same_file(self, src: str, dst: str) -> bool:
+        if not os.path.isfile(dst):
+            return False
+        if os.path.getsize(src) != os.path.getsize(dst):
+            return False
+        return self._hash_file(src) == self._hash_file(dst)
+
+    def deploy_mod(self) -> list[str]:
+        """
+        Sync mod folder to target and return relative paths of copied files
+        Only changed files are copied, and files overwritten for the first time
+        are backed up to res_mods_backup next to the target
+        """
         if not os.path.isdir(self.modpath):
             raise FileNotFoundError(f"res_mods not found in {self.modpath}")
 
-        # backup old mods
-        if os.path.isdir(self.target):
-            self.backup = os.path.join(self.target, "..", "res_mods_backup")
-            shutil.copytree(self.target, self.backup)
-            shutil.rmtree(self.target)
+        self.backup = os.path.join(self.target, "..", "res_mods_backup")
+        copied = []
+        for root, dirs, files in os.walk(self.modpath):
+            dirs[:] = [d for d in dirs if d != "__pycache__"]
+            for name in files:
+                src = os.path.join(root, name)
+                rel = os.path.relpath(src, self.modpath)
+                dst = os.path.join(self.target, rel)
+                if self._is_same_file(src, dst):
+                    continue
+
+                # backup the file to overwrite unless an older one is kept
+                backup = os.path.join(self.backup, rel)
+                if os.path.isfile(dst) and not os.path.exists(backup):
+                    os.makedirs(os.path.dirname(backup), exist_ok=True)
+                    shutil.copy2(dst, backup)
+
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                shutil.copy2(src, dst)
+                copied.append(rel)
 
-        # copy mods
-        os.makedirs(self.target, exist_ok=True)
-        shutil.copytree(self.modpath, self.target)
+        log.info(f"Deployed {len(copied)} mod files to {self.target}")
+        return copied
+
+    @property
+    def source(self) -> ModDataReader | ModListener:
+        """Listener if the mod is connected, otherwise the journal file"""
+        if self.listener is not None and self.listener.connected:
+            return self.listener
+        return self.reader
+
+    @property
+    def updated(self) -> float:
+        """Time when game data last changed"""
+        return self.source.updated
+
+    def close(self):
+        if self.listener is not None:
+            self.write_port(0)
+            self.listener.stop()
+
+    def poll(self) -> set[str]:
+        """Return keys of game data changed since last poll"""
+        return self.source.poll()
 
     def get_data(self) -> dict:
-        with open(self.data_path, "r") as f:
-            self.data = json.load(f)
+        """Get a copy of game data merged from the mod"""
+        source = self.source
+        source.poll()
+        self.data = dict(source.data)
         return self.data
+
+    def get(self, key: str, default=None):
+        """Get a value of game data"""
+        return self.source.get(key, default)
+
+    def wait_for_change(self, keys: list[str] | None = None, timeout: float | None = None) -> set[str]:
+        """Block until any of keys changes in game data or timeout"""
+        return self.source.wait_for_change(keys, timeout)
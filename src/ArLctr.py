@@ -2,31 +2,276 @@
 
 import json
 import logging
+import math
 import os
 import threading
+import time
 
-from collections import defaultdict
+from collections import defaultdict, deque
+from collections.abc import Iterable, Mapping
 from dataclasses import dataclass
+from functools import cached_property
+from types import MappingProxyType
+from typing import Any
 
 import numpy as np
 import cv2
 from sklearn.cluster import KMeans
 from ultralytics import YOLO
 
+try:
+    import onnxruntime as ort
+except ImportError:  # state classifier is optional
+    ort = None
+
+from .WinMgr import Frame
+from .PfMon import timed
+
 log = logging.getLogger(__name__)
 
 
-def load_config(json_path: str) -> dict:
+@dataclass(frozen=True)
+class Position:
+    x: int
+    y: int
+
+    def __iter__(self):
+        return iter((self.x, self.y))
+
+
+@dataclass(frozen=True)
+class Area:
+    """Rectangle on screen, unpacks as x, y, w, h"""
+    x: int
+    y: int
+    w: int
+    h: int
+
+    def __iter__(self):
+        return iter((self.x, self.y, self.w, self.h))
+
+    @cached_property
+    def roi(self) -> tuple[slice, slice]:
+        """Slices to index the area out of a screen array"""
+        return slice(self.y, self.y + self.h), slice(self.x, self.x + self.w)
+
+
+@dataclass(frozen=True)
+class TemplateSpec:
+    name: str
+    weight: float
+    area: Area
+
+
+@dataclass(frozen=True)
+class CoarseScan:
+    """Scan downscaled or gray frames first, confirm candidates at full resolution"""
+    enabled: bool = False
+    factor: int = 2  # downscale factor, 1 to keep size
+    gray: bool = False
+    slack: float = 0.1  # coarse score below the best by more than slack is skipped
+    margin: int = 2  # pixels around the coarse location to confirm in
+
+
+@dataclass(frozen=True)
+class Classifier:
+    """Classify the state from a downscaled frame, confirm top candidates by template matching"""
+    enabled: bool = False
+    model: str = "state_classifier.onnx"  # in resources/models, labels in its .json sidecar
+    top_k: int = 3  # candidates to confirm before a full scan
+    min_prob: float = 0.01  # templates of higher weight rated this likely are still confirmed
+
+
+@dataclass(frozen=True)
+class Config:
+    """
+    Validated and compiled config.json, read-only
+    Areas and positions are in pixels of the region size
+    """
+    region: Area
+    base_resolution: tuple[int, int]
+    template_scale: float
+    match_threshold: float
+    coarse_scan: CoarseScan
+    classifier: Classifier
+    model_compass: str
+    model_minimap: str
+    model_warship: str
+    positions: Mapping[str, Position]
+    areas: Mapping[str, Area]
+    templates: Mapping[str, TemplateSpec]
+    mod_data: Mapping[str, Any]
+    perf: Mapping[str, Any]
+    trace: Mapping[str, Any]
+    adaptive_areas: Mapping[str, Any]
+
+
+NO_AREA = Area(0, 0, 0, 0)
+
+
+def _freeze(value: Any) -> Any:
+    """Turn nested dicts and lists into read-only mappings and tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _ints(value: Any, n: int, key: str) -> list[int]:
+    if not isinstance(value, (list, tuple)) or len(value) != n:
+        raise ValueError(f"'{key}' in config.json is not {n}-int list")
+    return [int(v) for v in value]
+
+
+def _coords(value: Any, n: int, key: str, size: tuple[int, int],
+            base: tuple[int, int]) -> list[float]:
+    """
+    Convert coordinates to pixels of size
+    Lists are pixels of base resolution, {"norm": [...]} is normalized to [0, 1]
+    """
+    norm = isinstance(value, dict)
+    if norm:
+        value = value.get("norm")
+    if not isinstance(value, (list, tuple)) or len(value) != n:
+        raise ValueError(f"'{key}' in config.json is not {n}-number list or {{\"norm\": list}}")
+    if norm and not all(0 <= float(v) <= 1 for v in value):
+        raise ValueError(f"'{key}' in config.json has normalized values out of [0, 1]")
+    scale = (1.0, 1.0) if norm else (1 / base[0], 1 / base[1])
+    return [float(v) * scale[i % 2] * size[i % 2] for i, v in enumerate(value)]
+
+
+def _coarse_scan(value: dict) -> CoarseScan:
+    coarse = CoarseScan(enabled=bool(value.get("enabled", False)),
+                        factor=int(value.get("factor", 2)),
+                        gray=bool(value.get("gray", False)),
+                        slack=float(value.get("slack", 0.1)),
+                        margin=int(value.get("margin", 2)))
+    if coarse.factor < 1 or coarse.margin < 0:
+        raise ValueError("'coarse_scan' in config.json needs factor >= 1 and margin >= 0")
+    return coarse
+
+
+def _classifier(value: dict) -> Classifier:
+    classifier = Classifier(enabled=bool(value.get("enabled", False)),
+                            model=str(value.get("model", "state_classifier.onnx")),
+                            top_k=int(value.get("top_k", 3)),
+                            min_prob=float(value.get("min_prob", 0.01)))
+    if classifier.top_k < 1 or not 0 <= classifier.min_prob <= 1:
+        raise ValueError("'classifier' in config.json needs top_k >= 1 and min_prob in [0, 1]")
+    return classifier
+
+
+def compile_config(config: dict) -> Config:
+    """Validate raw config and compile it into typed read-only structure"""
+    required_keys = ["region", "positions", "areas", "templates"]
+    missing_keys = [key for key in required_keys if key not in config]
+    if missing_keys:
+        raise ValueError(f"Missing keys in config.json, {missing_keys}")
+
+    region = Area(*_ints(config["region"], 4, "region"))
+    size = (region.w, region.h)
+    base = tuple(_ints(config.get("base_resolution", size), 2, "base_resolution"))
+    if abs(region.w * base[1] - region.h * base[0]) > 0.01 * region.h * base[0]:
+        # areas scale per axis but templates uniformly, UI anchors may differ too
+        log.warning(f"Aspect of region {region.w}x{region.h} differs from base resolution "
+                    f"{base[0]}x{base[1]}, areas and positions may miss their elements")
+
+    def position(value: Any, key: str) -> Position:
+        x, y = _coords(value, 2, key, size, base)  # type: ignore
+        return Position(round(x), round(y))
+
+    def area(value: Any, key: str) -> Area:
+        # widen to whole pixels so scaled templates still fit in
+        x, y, w, h = _coords(value, 4, key, size, base)  # type: ignore
+        x0, y0 = max(0, math.floor(x)), max(0, math.floor(y))
+        x1, y1 = min(region.w, math.ceil(x + w)), min(region.h, math.ceil(y + h))
+        return Area(x0, y0, x1 - x0, y1 - y0)
+
+    positions = {key: position(pos, key) for key, pos in config["positions"].items()}
+    areas = {}
+    for key, value in config["areas"].items():
+        name = str(value.get("name", key))
+        areas[name] = area(value.get("area"), name)
+    templates = {}
+    full = Area(0, 0, region.w, region.h)
+    for key, tmpl in config["templates"].items():
+        name = str(tmpl.get("name", key))
+        tmpl_area = area(tmpl["area"], name) if "area" in tmpl else full
+        templates[name] = TemplateSpec(name=name, weight=float(tmpl.get("weight", 1.0)), area=tmpl_area)
+
+    return Config(region=region,
+                  base_resolution=base,  # type: ignore
+                  # UI keeps its aspect, so templates scale uniformly by the smaller factor
+                  template_scale=min(region.w / base[0], region.h / base[1]),
+                  match_threshold=float(config.get("match_threshold", 0.7)),
+                  coarse_scan=_coarse_scan(config.get("coarse_scan", {})),
+                  classifier=_classifier(config.get("classifier", {})),
+                  model_compass=str(config.get("model_compass", "")),
+                  model_minimap=str(config.get("model_minimap", "")),
+                  model_warship=str(config.get("model_warship", "")),
+                  positions=MappingProxyType(positions),
+                  areas=MappingProxyType(areas),
+                  templates=MappingProxyType(templates),
+                  mod_data=_freeze(config.get("mod_data", {})),
+                  perf=_freeze(config.get("perf", {})),
+                  trace=_freeze(config.get("trace", {})),
+                  adaptive_areas=_freeze(config.get("adaptive_areas", {})))
+
+
+def load_template_image(path: str, scale: float, cache_dir: str) -> np.ndarray | None:
+    """Read a template image rescaled by scale, through an on-disk cache"""
+    if not os.path.exists(path):
+        return None
+    if scale == 1:
+        return cv2.imread(path, cv2.IMREAD_COLOR)
+
+    cache_path = os.path.join(cache_dir, os.path.basename(path))
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        image = cv2.imread(cache_path, cv2.IMREAD_COLOR)
+        if image is not None:
+            return image
+
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    h, w = image.shape[:2]
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    image = cv2.resize(image, size, interpolation=interpolation)
+    os.makedirs(cache_dir, exist_ok=True)
+    cv2.imwrite(cache_path, image)
+    log.debug(f"Cached template {path} scaled by {scale:.3f} at {cache_path}")
+    return image
+
+
+def load_optimized_meta(path: str) -> dict[str, dict]:
+    """Load metadata of optimized templates written by tools.optimize_templates"""
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return {}
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        log.warning(f"Failed to load optimized templates, {e}")
+        return {}
+
+
+def template_cache_dir(config: Config, language: str) -> str:
+    """Cache directory of templates rescaled for the region resolution"""
+    bw, bh = config.base_resolution
+    key = f"{bw}x{bh}_to_{config.region.w}x{config.region.h}"
+    return os.path.join("resources", "cache", "templates", language, key)
+
+
+def load_config(json_path: str) -> Config:
     """Load configuration from JSON file"""
     if not os.path.exists(json_path):
         raise FileNotFoundError(f"'config.json' not found at {json_path}")
     with open(json_path, "r", encoding="utf-8") as f:
         config = json.load(f)
-    required_keys = ["region", "positions", "areas", "templates"]
-    missing_keys = [key for key in required_keys if key not in config]
-    if missing_keys:
-        raise ValueError(f"Missing keys in config.json, {missing_keys}")
-    return config
+    return compile_config(config)
 
 
 def load_user(user_path: str) -> dict:
@@ -47,17 +292,265 @@ class Template:
     name: str
     path: str
     weight: float
-    area: tuple[int, int, int, int]
+    area: Area
+    image: np.ndarray
+    coarse: np.ndarray | None = None  # image for coarse scan
+    mask: np.ndarray | None = None  # pixels to match of an optimized template
+    offset: tuple[int, int] = (0, 0)  # of an optimized crop in the full template
+    size: tuple[int, int] = (0, 0)  # width and height of the full template
 
 
-@dataclass
 class Match:
-    name: str
-    loc: tuple[int, int, int, int]
-    val: float
-    area: tuple[int, int, int, int]
-    roi: np.ndarray
-    screen: np.ndarray
+    """Match result holding the matched frame, not copies of it"""
+    __slots__ = ("name", "loc", "val", "area", "frame")
+
+    def __init__(self, name: str, loc: tuple[int, int, int, int], val: float,
+                 area: Area, frame: Frame):
+        self.name = name
+        self.loc = loc
+        self.val = val
+        self.area = area
+        self.frame = frame
+
+    def __repr__(self) -> str:
+        return f"Match(name={self.name!r}, loc={self.loc}, val={self.val:.3f}, area={self.area})"
+
+    @property
+    def screen(self) -> np.ndarray:
+        return self.frame.array
+
+    @property
+    def roi(self) -> np.ndarray:
+        """Area of the matched template on screen, the whole screen if no area"""
+        if self.area.w <= 0 or self.area.h <= 0:
+            return self.frame.array
+        return self.frame.array[self.area.roi]
+
+    def replace(self, **changes) -> "Match":
+        """Copy with fields changed"""
+        fields = {k: getattr(self, k) for k in self.__slots__}
+        return Match(**{**fields, **changes})
+
+
+class OverlayViewer:
+    """
+    Show debug overlays from a single viewer thread
+    Images are pushed into a bounded queue dropping the oldest under pressure,
+    so callers never wait for a window
+    """
+
+    def __init__(self, max_images: int = 4, duration: float = 3):
+        self.images: deque[tuple[str, tuple[int, int], np.ndarray]] = deque(maxlen=max_images)
+        self.duration = duration  # seconds to keep a window shown
+        self.cond = threading.Condition()
+        self.thread: threading.Thread | None = None
+
+    def push(self, name: str, loc: tuple[int, int], image: np.ndarray):
+        with self.cond:
+            self.images.append((name, loc, image))
+            self.cond.notify()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _show(self, name: str, loc: tuple[int, int], image: np.ndarray) -> str:
+        # Use a default window name if name is "unknown" to avoid OpenCV errors
+        window_name = "result" if name == "unknown" else name
+        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+        cv2.setWindowProperty(window_name, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
+        height, width = image.shape[:2]
+        cv2.resizeWindow(window_name, width, height)
+        cv2.moveWindow(window_name, loc[0], loc[1])
+        try:
+            cv2.setWindowProperty(window_name, cv2.WND_PROP_TOPMOST, 1)
+        except AttributeError:
+            pass
+        cv2.imshow(window_name, image)
+        return window_name
+
+    def _run(self):
+        expires: dict[str, float] = {}  # window name -> time to destroy
+        while True:
+            with self.cond:
+                # wait long when idle, only pump window events while shown
+                self.cond.wait_for(lambda: len(self.images) > 0, None if not expires else 0.05)
+                images = list(self.images)
+                self.images.clear()
+
+            for name, loc, image in images:
+                window_name = self._show(name, loc, image)
+                expires[window_name] = time.monotonic() + self.duration
+            cv2.waitKey(1)
+
+            now = time.monotonic()
+            for window_name in [w for w, t in expires.items() if t <= now]:
+                cv2.destroyWindow(window_name)
+                del expires[window_name]
+
+
+viewer = OverlayViewer()
+
+
+class AreaTracker:
+    """
+    Record where templates match to tighten their search areas
+    A tightened area covers all hits plus margin, it is widened by hits found
+    in full-area rescans and reset to the configured area after repeated misses
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.apply = False  # search in tightened areas, otherwise only record
+        self.margin = 16
+        self.min_hits = 20  # hits before an area is tightened
+        self.max_misses = 3  # misses before an area is reset
+        self.path = os.path.join("logs", "areas.json")
+        self.interval = 60.0  # seconds between saves
+        self.region: tuple[int, int] = (0, 0)
+        self.saved = time.monotonic()
+        self.stats: dict[str, dict] = {}  # name -> {"bbox": [x0, y0, x1, y1], "hits", "misses"}
+        self.tight: dict[str, Area] = {}
+        self.lock = threading.Lock()
+
+    def configure(self, region: tuple[int, int], enabled: bool = False, apply: bool = False,
+                  margin: int = 16, min_hits: int = 20, max_misses: int = 3,
+                  path: str | None = None, interval: float | None = None):
+        self.enabled = enabled
+        self.apply = apply
+        self.margin = margin
+        self.min_hits = min_hits
+        self.max_misses = max_misses
+        self.path = path or self.path
+        self.interval = interval or self.interval
+        if tuple(region) != self.region:
+            self.region = tuple(region)  # type: ignore
+            self.stats = {}
+            self.tight = {}
+            if enabled:
+                self.load()
+        if enabled:
+            log.info(f"Area tracker enabled, apply {apply}, saving to {self.path}")
+
+    def area(self, tmpl: Template) -> Area:
+        """Area to search a template in"""
+        if not self.apply:
+            return tmpl.area
+        tight = self.tight.get(tmpl.name)
+        if tight is None:
+            stat = self.stats.get(tmpl.name)
+            if stat is None or stat["hits"] < self.min_hits:
+                return tmpl.area
+            tight = self.tight[tmpl.name] = self.tighten(tmpl.area, stat["bbox"])
+        return tight
+
+    def tighten(self, area: Area, bbox: list[int]) -> Area:
+        """Bounding box of hits with margin, inside the configured area"""
+        x0, y0, x1, y1 = bbox
+        x0, y0 = max(area.x, x0 - self.margin), max(area.y, y0 - self.margin)
+        x1, y1 = min(area.x + area.w, x1 + self.margin), min(area.y + area.h, y1 + self.margin)
+        return Area(x0, y0, x1 - x0, y1 - y0)
+
+    def _grow(self, name: str, loc: tuple[int, int, int, int]) -> dict:
+        """Grow bounding box of a template to cover loc"""
+        x, y, w, h = loc
+        stat = self.stats.setdefault(name, {"bbox": [x, y, x + w, y + h], "hits": 0, "misses": 0})
+        bbox = stat["bbox"]
+        grown = [min(bbox[0], x), min(bbox[1], y), max(bbox[2], x + w), max(bbox[3], y + h)]
+        if grown != bbox:
+            stat["bbox"] = grown
+            self.tight.pop(name, None)
+        return stat
+
+    def hit(self, name: str, loc: tuple[int, int, int, int]):
+        """Record a match location"""
+        with self.lock:
+            self._grow(name, loc)["hits"] += 1
+        self.maybe_save()
+
+    def miss(self, name: str, loc: tuple[int, int, int, int]):
+        """Record a match found only outside the tightened area"""
+        x, y, w, h = loc
+        with self.lock:
+            log.info(f"Template {name} missed tightened area {self.tight.get(name)}")
+            stat = self._grow(name, loc)
+            stat["misses"] += 1
+            if stat["misses"] >= self.max_misses:
+                log.info(f"Template {name} missed {stat['misses']} times, area reset")
+                self.stats[name] = {"bbox": [x, y, x + w, y + h], "hits": 0, "misses": 0}
+                self.tight.pop(name, None)
+        self.maybe_save()
+
+    def suggest(self, areas: Mapping[str, Area]) -> dict[str, Area]:
+        """Tightened areas of templates with enough hits"""
+        with self.lock:
+            return {name: self.tighten(areas[name], stat["bbox"])
+                    for name, stat in self.stats.items()
+                    if name in areas and stat["hits"] >= self.min_hits}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning(f"Failed to load area history, {e}")
+            return
+        if tuple(data.get("region", ())) != self.region:
+            log.info("Area history of another region size ignored")
+            return
+        self.stats = data.get("templates", {})
+
+    def save(self):
+        self.saved = time.monotonic()
+        with self.lock:
+            data = {"region": list(self.region), "templates": self.stats}
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+
+    def maybe_save(self):
+        """Save if interval elapsed"""
+        if time.monotonic() - self.saved >= self.interval:
+            try:
+                self.save()
+            except OSError as e:
+                log.warning(f"Failed to save area history, {e}")
+
+
+area_tracker = AreaTracker()
+
+
+class StateClassifier:
+    """Tiny ONNX network ranking states from a downscaled whole frame"""
+
+    def __init__(self, path: str):
+        with open(os.path.splitext(path)[0] + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.labels: list[str] = list(meta["labels"])
+        self.size: tuple[int, int] = (int(meta["size"][0]), int(meta["size"][1]))  # input width, height
+        self.session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self.input = self.session.get_inputs()[0].name
+
+    @staticmethod
+    def preprocess(image: np.ndarray, size: tuple[int, int]) -> np.ndarray:
+        """Downscale a screen into a CHW float input, shared with training"""
+        # subsample to about twice the input size first, INTER_AREA is slow at large factors
+        step = max(1, min(image.shape[1] // (2 * size[0]), image.shape[0] // (2 * size[1])))
+        small = cv2.resize(image[::step, ::step], size, interpolation=cv2.INTER_AREA)
+        return small.transpose(2, 0, 1).astype(np.float32) / 255
+
+    @timed()
+    def rank(self, frame: Frame) -> list[tuple[str, float]]:
+        """States with probabilities, most likely first, computed once per capture"""
+        ranked = frame.cache.get("states")
+        if ranked is None:
+            logits = self.session.run(None, {self.input: self.preprocess(frame.array, self.size)[None]})[0][0]
+            probs = np.exp(logits - logits.max())
+            probs /= probs.sum()
+            ranked = [(self.labels[i], float(probs[i])) for i in np.argsort(probs)[::-1]]
+            frame.cache["states"] = ranked
+        return ranked  # type: ignore
 
 
 class AreaLocator:
@@ -71,73 +564,164 @@ class AreaLocator:
         self.config = load_config(json_path)
         self.user = load_user(user_path)
         self.templates = self.load_templates(win_title, templates_path,)
-        self.model_compass = self.load_model(models_path, self.config["model_compass"])
-        self.model_minimap = self.load_model(models_path, self.config["model_minimap"])
-        self.model_warship = self.load_model(models_path, self.config["model_warship"])
+        # template orders by weight, cached per list of names
+        self._orders: dict[tuple[str, ...], tuple[Template, ...]] = {}
+        self.model_compass = self.load_model(models_path, self.config.model_compass)
+        self.model_minimap = self.load_model(models_path, self.config.model_minimap)
+        self.model_warship = self.load_model(models_path, self.config.model_warship)
+        self.classifier = self.load_classifier(models_path)
 
     def load_templates(self, win_title: str, templates_path: str) -> dict[str, Template]:
         """Load templates from the templates directory"""
         language: str = self.user["title_lang_map"][win_title]
-        templates: dict[str, dict] = self.config["templates"]
+        scale = self.config.template_scale
+        cache_dir = template_cache_dir(self.config, language)
+        optimized_path = os.path.join(templates_path, language, "optimized")
+        optimized = load_optimized_meta(optimized_path)
         tmpls = {}
-        for key, tmpl in templates.items():
-            name = str(tmpl.get("name", key))
-            path = os.path.join(templates_path, language, f"{name}.png")
-            if not os.path.exists(path):
+        for name, spec in self.config.templates.items():
+            meta = optimized.get(name)
+            if meta:  # prefer cropped template with mask
+                path = os.path.join(optimized_path, f"{name}.png")
+                image = load_template_image(path, scale, os.path.join(cache_dir, "optimized"))
+            else:
+                path = os.path.join(templates_path, language, f"{name}.png")
+                image = load_template_image(path, scale, cache_dir)
+            if image is None:
                 log.warning(f"Template {name} not found at {path}")
                 continue
-            weight = float(tmpl.get("weight", 1.0))
-            area = tuple(map(int, tmpl.get("area", self.config["region"])))
-            if len(area) != 4:
-                log.warning(f"Area for template {name} is not 4-int list")
-                continue
-            tmpls[name] = Template(name=name, path=path, weight=weight, area=area)
+
+            mask = None
+            offset = (0, 0)
+            size = (image.shape[1], image.shape[0])
+            if meta:
+                offset = (round(meta["offset"][0] * scale), round(meta["offset"][1] * scale))
+                size = (round(meta["size"][0] * scale), round(meta["size"][1] * scale))
+                if meta.get("mask"):
+                    mask_path = os.path.join(optimized_path, f"{name}_mask.png")
+                    mask = load_template_image(mask_path, scale, os.path.join(cache_dir, "optimized"))
+                    if mask is not None:
+                        mask = np.where(mask[:, :, 0] > 127, 255, 0).astype(np.uint8)
+            tmpls[name] = Template(name=name, path=path, weight=spec.weight, area=spec.area, image=image,
+                                   coarse=self._coarse_image(image) if mask is None else None,
+                                   mask=mask, offset=offset, size=size)
         return tmpls
 
+    def _coarse_image(self, image: np.ndarray) -> np.ndarray | None:
+        """Downscale and gray an image for coarse scan, None if disabled or too small"""
+        coarse = self.config.coarse_scan
+        if not coarse.enabled:
+            return None
+        h, w = image.shape[:2]
+        if min(h, w) // coarse.factor < 4:
+            return None  # too few pixels to rank candidates
+        if coarse.factor > 1:
+            image = cv2.resize(image, (w // coarse.factor, h // coarse.factor), interpolation=cv2.INTER_AREA)
+        if coarse.gray:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return image
+
+    def _coarse_screen(self, frame: Frame) -> np.ndarray:
+        """Coarse image of a frame, computed once per capture"""
+        screen = frame.cache.get("coarse")
+        if screen is None:
+            screen = self._coarse_image(frame.array)
+            frame.cache["coarse"] = screen
+        return screen  # type: ignore
+
+    def _match_one(self, frame: Frame, tmpl: Template, best: float,
+                   area: Area | None = None) -> tuple[float, tuple[int, int]]:
+        """
+        Match a template in area, its own by default, and return score and location
+        of the full template on screen
+        With coarse scan, the full resolution match only runs around the coarse
+        location if the coarse score is close to the best so far
+        """
+        x, y, w, h = area or tmpl.area
+        if tmpl.coarse is not None:
+            coarse = self.config.coarse_scan
+            f = coarse.factor
+            roi = self._coarse_screen(frame)[y // f:(y + h) // f, x // f:(x + w) // f]
+            th, tw = tmpl.coarse.shape[:2]
+            if roi.shape[0] >= th and roi.shape[1] >= tw:
+                result = cv2.matchTemplate(roi, tmpl.coarse, cv2.TM_CCOEFF_NORMED)
+                _, val_max, _, loc_max = cv2.minMaxLoc(result)
+                if val_max < best - coarse.slack:
+                    return val_max, (0, 0)
+                # confirm in a small area around the coarse location
+                th, tw = tmpl.image.shape[:2]
+                m = coarse.margin + f
+                x0 = max(x, x + loc_max[0] * f - m)
+                y0 = max(y, y + loc_max[1] * f - m)
+                x1 = min(x + w, x + loc_max[0] * f + tw + m)
+                y1 = min(y + h, y + loc_max[1] * f + th + m)
+                x, y, w, h = x0, y0, x1 - x0, y1 - y0
+
+        roi = frame.array[y:y + h, x:x + w]
+        if tmpl.mask is not None:
+            result = cv2.matchTemplate(roi, tmpl.image, cv2.TM_CCOEFF_NORMED, mask=tmpl.mask)
+            result = np.nan_to_num(result, nan=0.0, posinf=0.0, neginf=0.0)  # flat windows
+        else:
+            result = cv2.matchTemplate(roi, tmpl.image, cv2.TM_CCOEFF_NORMED)
+        _, val_max, _, loc_max = cv2.minMaxLoc(result)
+        dx, dy = tmpl.offset
+        return val_max, (x + loc_max[0] - dx, y + loc_max[1] - dy)
+
     def load_model(self, models_path: str, name: str) -> YOLO | None:
         """Load a YOLO model from the models directory"""
         path = os.path.join(models_path, name)
-        if os.path.exists(path):
+        if name and os.path.exists(path):
             log.info(f"Loaded model {name}")
             return YOLO(path)
         else:
             log.warning(f"Model {name} not found")
             return None
 
-    def get_templates(self, names: list[str]) -> list[Template]:
+    def load_classifier(self, models_path: str) -> StateClassifier | None:
+        """Load the state classifier if enabled"""
+        name = self.config.classifier.model
+        path = os.path.join(models_path, name)
+        if not self.config.classifier.enabled:
+            return None
+        if ort is None:
+            log.warning("State classifier needs onnxruntime, disabled")
+            return None
+        if not os.path.exists(path):
+            log.warning(f"Model {name} not found")
+            return None
+        try:
+            classifier = StateClassifier(path)
+        except Exception as e:
+            log.warning(f"Failed to load state classifier {name}, {e}")
+            return None
+        unknown = [label for label in classifier.labels if label != "unknown" and label not in self.templates]
+        if unknown:
+            log.warning(f"State classifier labels {unknown} are no templates")
+        log.info(f"Loaded model {name}")
+        return classifier
+
+    def get_templates(self, names: list[str]) -> tuple[Template, ...]:
         """Get sorted templates by names or all templates if names is empty"""
-        names = names or list(self.templates.keys())
+        key = tuple(names)  # equal weights keep the order of names
+        tmpls = self._orders.get(key)
+        if tmpls is not None:
+            return tmpls
+
         tmpls = []
-        for name in names:
-            if name not in self.config["templates"]:
+        for name in names or self.templates.keys():
+            if name not in self.config.templates:
                 log.warning(f"Template '{name}' not found in 'templates' of config")
                 continue
+            if name not in self.templates:
+                continue  # image missing, warned on load
             tmpls.append(self.templates[name])
-
         tmpls.sort(key=lambda x: x.weight, reverse=True)
+        self._orders[key] = tmpls = tuple(tmpls)
         return tmpls
 
     def _show_window(self, name: str, loc: tuple[int, int], image: np.ndarray):
-        """Display an image in a named OpenCV window"""
-        def show_image():
-            # Use a default window name if name is "unknown" to avoid OpenCV errors
-            window_name = "result" if name == "unknown" else name
-            cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
-            cv2.setWindowProperty(window_name, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
-            height, width = image.shape[:2]
-            cv2.resizeWindow(window_name, width, height)
-            cv2.moveWindow(window_name, loc[0], loc[1])
-            try:
-                cv2.setWindowProperty(window_name, cv2.WND_PROP_TOPMOST, 1)
-            except AttributeError:
-                pass
-            cv2.imshow(window_name, image)
-            cv2.waitKey(3000)
-            cv2.destroyWindow(window_name)
-
-        thread = threading.Thread(target=show_image, daemon=True)
-        thread.start()
-        thread.join(timeout=3)
+        """Display an image in a named OpenCV window without blocking"""
+        viewer.push(name=name, loc=loc, image=image)
 
     def _draw_overlay(self, screen: np.ndarray, elems: list[tuple[str, tuple]]) -> np.ndarray:
         """
@@ -168,32 +752,72 @@ class AreaLocator:
         result = cv2.add(background, foreground)
         return result
 
-    def match_template(self, screen: np.ndarray, names: list[str] | None = None,
+    def _candidates(self, frame: Frame, tmpls: tuple[Template, ...]) -> list[Template]:
+        """Templates of the top states ranked by the classifier, in weight order"""
+        ranked = {name for name, _ in self.classifier.rank(frame)[:self.config.classifier.top_k]}  # type: ignore
+        return [tmpl for tmpl in tmpls if tmpl.name in ranked]
+
+    def _scan(self, frame: Frame, tmpls: Iterable[Template], match: Match,
+              missed: set[str]) -> Match:
+        """
+        Match templates in order until one reaches the threshold, return the best
+        A template not found in its tightened area is searched in its full area
+        before the next one, so tightened areas never change which template wins
+        """
+        threshold = self.config.match_threshold
+        tracking = area_tracker.enabled
+        for tmpl in tmpls:
+            area = area_tracker.area(tmpl) if tracking else tmpl.area
+            val_max, (x, y) = self._match_one(frame, tmpl, best=match.val, area=area)
+            if val_max < threshold and area is not tmpl.area:
+                val_max, (x, y) = self._match_one(frame, tmpl, best=match.val)
+                if val_max >= threshold:
+                    area_tracker.miss(tmpl.name, (x, y, *tmpl.size))
+                    missed.add(tmpl.name)
+
+            if val_max >= match.val:
+                loc = (x, y, *tmpl.size)
+                match = Match(name=tmpl.name, loc=loc, val=val_max, area=tmpl.area, frame=frame)
+            if val_max >= threshold:
+                break
+        return match
+
+    @timed()
+    def match_template(self, screen: Frame | np.ndarray, names: list[str] | None = None,
                        show: bool = False) -> Match:
         """Match template on screen and return the best match"""
         if names is None:
             names = []
+        frame = screen if isinstance(screen, Frame) else Frame(screen)
 
-        threshold = self.config.get("match_threshold", 0.7)
-        match = Match(name="unknown", loc=(0, 0, 0, 0), val=0.65, area=(0, 0, 0, 0),
-                      roi=screen, screen=screen)
+        threshold = self.config.match_threshold
+        match = Match(name="unknown", loc=(0, 0, 0, 0), val=0.65, area=NO_AREA, frame=frame)
 
-        for tmpl in self.get_templates(names):
-            x, y, w, h = tmpl.area
-            roi = screen[y:y + h, x:x + w]
-            img_tmpl = cv2.imread(tmpl.path, cv2.IMREAD_COLOR)
-            if img_tmpl is None:
-                log.warning(f"Template '{tmpl.name}' not found at '{tmpl.path}'")
-                continue
-
-            result = cv2.matchTemplate(roi, img_tmpl, cv2.TM_CCOEFF_NORMED)
-            val_min, val_max, loc_min, loc_max = cv2.minMaxLoc(result)
+        tmpls = self.get_templates(names)
+        missed: set[str] = set()  # templates found only outside their tightened areas
+        if self.classifier is None or len(tmpls) <= self.config.classifier.top_k:
+            # a targeted match of few templates has no candidates to skip
+            match = self._scan(frame, tmpls, match, missed)
+        else:
+            # confirm the likely states first, then templates of higher weight the
+            # classifier did not learn or cannot rule out, which win as in the full scan
+            candidates = self._candidates(frame, tmpls)
+            tried = {tmpl.name for tmpl in candidates}
+            match = self._scan(frame, candidates, match, missed)
+            if match.val >= threshold:
+                probs = dict(self.classifier.rank(frame))
+                min_prob = self.config.classifier.min_prob
+                found = next(i for i, tmpl in enumerate(tmpls) if tmpl.name == match.name)
+                higher = (tmpl for tmpl in tmpls[:found]
+                          if tmpl.name not in tried and probs.get(tmpl.name, 1.0) >= min_prob)
+                higher = self._scan(frame, higher, match.replace(name="unknown", val=threshold), missed)
+                if higher.name != "unknown":
+                    match = higher
+            else:
+                match = self._scan(frame, (tmpl for tmpl in tmpls if tmpl.name not in tried), match, missed)
 
-            if val_max >= match.val:
-                loc = (x + loc_max[0], y + loc_max[1], img_tmpl.shape[1], img_tmpl.shape[0])
-                match = Match(name=tmpl.name, loc=loc, val=val_max, area=tmpl.area, roi=roi, screen=screen)
-            if val_max >= threshold:
-                break
+        if area_tracker.enabled and match.val >= threshold and match.name not in missed:
+            area_tracker.hit(match.name, match.loc)
 
         name = match.name
         log.info(f"Matched {name}")
@@ -212,20 +836,22 @@ class AreaLocator:
 
             # Show
             overlay = self._draw_overlay(screen=match.roi, elems=elems)
-            self._show_window(name=name, loc=match.area[:2], image=overlay)
+            self._show_window(name=name, loc=(match.area.x, match.area.y), image=overlay)
 
         return match
 
-    def read_bigmap(self, screen: np.ndarray, show: bool = False) -> list[tuple[int, int]] | None:
+    @timed()
+    def read_bigmap(self, screen: Frame | np.ndarray, show: bool = False) -> list[tuple[int, int]] | None:
         """Read bigmap and return red point coordinates"""
         # Validate area configuration
-        if "bigmap" not in self.config["areas"]:
+        if "bigmap" not in self.config.areas:
             log.error("Bigmap area not configured")
             return None
 
-        area = self.config["areas"]["bigmap"]["area"]
+        area = self.config.areas["bigmap"]
         x, y, w, h = area
-        roi = screen[y:y + h, x:x + w]
+        screen = screen.array if isinstance(screen, Frame) else screen
+        roi = screen[area.roi]
 
         # Find all red points
         hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
@@ -259,7 +885,8 @@ class AreaLocator:
 
         return centers
 
-    def read_minimap(self, screen: np.ndarray, show: bool = False) -> dict[str, list[np.ndarray]] | None:
+    @timed()
+    def read_minimap(self, screen: Frame | np.ndarray, show: bool = False) -> dict[str, list[np.ndarray]] | None:
         """
         Read minimap and return ship positions and directions
         Returns: {"self": [arr(x, y), arr(dx, dy)],
@@ -267,7 +894,7 @@ class AreaLocator:
                   "enemy": [arr(x1, y1), arr(x2, y2),...]}
         """
         # Validate area configuration and model availability
-        if "minimap" not in self.config["areas"]:
+        if "minimap" not in self.config.areas:
             log.error("Minimap area not configured")
             return None
 
@@ -275,9 +902,10 @@ class AreaLocator:
             log.error("Minimap model not loaded")
             return None
 
-        area = self.config["areas"]["minimap"]["area"]
+        area = self.config.areas["minimap"]
         x, y, w, h = area
-        roi = screen[y:y + h, x:x + w]
+        screen = screen.array if isinstance(screen, Frame) else screen
+        roi = screen[area.roi]
 
         # Predict
         data = defaultdict(list)
@@ -320,10 +948,11 @@ class AreaLocator:
 
         return dict(data)
 
-    def read_compass(self, screen: np.ndarray, show: bool = False) -> np.ndarray | None:
+    @timed()
+    def read_compass(self, screen: Frame | np.ndarray, show: bool = False) -> np.ndarray | None:
         """Read compass and return direction vector"""
         # Validate area configuration and model availability
-        if "compass" not in self.config["areas"]:
+        if "compass" not in self.config.areas:
             log.error("Compass area not configured")
             return None
 
@@ -331,9 +960,10 @@ class AreaLocator:
             log.error("Compass model not loaded")
             return None
 
-        area = self.config["areas"]["compass"]["area"]
+        area = self.config.areas["compass"]
         x, y, w, h = area
-        roi = screen[y:y + h, x:x + w]
+        screen = screen.array if isinstance(screen, Frame) else screen
+        roi = screen[area.roi]
 
         # Predict using the model
         best_conf = 0.0
@@ -1,32 +1,32 @@
 # src/Bot.py
 
 import logging
-import time
 import random
 import traceback
-from datetime import datetime, timedelta
+from datetime import timedelta
 from threading import Event
 
 import numpy as np
-import pydirectinput as pdi
-import win32api
-import win32con
 
 from .ArLctr import AreaLocator, Match
-from .WinMgr import WindowManager
-
-pdi.FAILSAFE = False
+from .WinMgr import Frame, WindowManager
+from .InMgr import InputManager
+from .Clock import Clock, default_clock
+from .PfMon import timed
 
 log = logging.getLogger(__name__)
 
 
 class BotBase:
 
-    def __init__(self, event: Event, arlctr: AreaLocator, wdmgr: WindowManager):
+    def __init__(self, event: Event, arlctr: AreaLocator, wdmgr: WindowManager,
+                 inmgr: InputManager | None = None, clock: Clock | None = None):
         self.event_stop = event
         self.arlctr = arlctr
         self.wdmgr = wdmgr
-        self.screen: np.ndarray | None = None
+        self.inmgr = inmgr or InputManager()
+        self.clock = clock or default_clock
+        self.frame: Frame | None = None  # last captured screen, passed on to reuse its caches
 
     def _check_event(self) -> bool:
         """Check if event is set"""
@@ -34,17 +34,18 @@ class BotBase:
             return True
         return False
 
+    @timed()
     def _sleep(self, t: float):
-        """Sleep randomly between t and 2t"""
+        """Sleep randomly between t and 2t, wake up at once on stop"""
         if self._check_event():
             return
-        time.sleep(random.uniform(t, t * 2))
+        self.clock.sleep(random.uniform(t, t * 2), event=self.event_stop)
 
     def _move_to(self, x: int, y: int):
         """Move mouse to a point(x, y)"""
         if self._check_event():
             return
-        x_start, y_start = pdi.position()
+        x_start, y_start = self.inmgr.position()
         dx = x - x_start
         dy = y - y_start
 
@@ -62,18 +63,18 @@ class BotBase:
             x_target = x_start + dx * ratio + x_jitter
             y_target = y_start + dy * ratio + y_jitter
 
-            pdi.moveTo(int(x_target), int(y_target))
+            self.inmgr.move_to(int(x_target), int(y_target))
             # self._sleep(duration / steps * random.uniform(0.05, 0.1))
 
         if not self._check_event():
-            pdi.moveTo(x, y)
+            self.inmgr.move_to(x, y)
 
     def _click(self, button: str = "primary", clicks: int = 1, interval: float = 0.1):
         for i in range(clicks):
             if self._check_event():
                 return
-            pdi.mouseDown(button=button, duration=interval)
-            pdi.mouseUp(button=button, duration=interval)
+            self.inmgr.mouse_down(button=button, duration=interval)
+            self.inmgr.mouse_up(button=button, duration=interval)
             self._sleep(interval)
 
     def _click_xy(self, x: int, y: int, button: str = "primary", clicks: int = 1, interval: float = 0.1):
@@ -86,9 +87,9 @@ class BotBase:
         for i in range(presses):
             if self._check_event():
                 return
-            pdi.keyDown(key)
+            self.inmgr.key_down(key)
             self._sleep(interval)
-            pdi.keyUp(key)
+            self.inmgr.key_up(key)
             self._sleep(interval)
 
     def _scroll(self, direction: int | bool | str = False, srolls: int = 1, interval: float = 0.1):
@@ -104,21 +105,21 @@ class BotBase:
         for i in range(srolls):
             if self._check_event():
                 return
-            win32api.mouse_event(win32con.MOUSEEVENTF_WHEEL, 0, 0, dw, 0)
+            self.inmgr.scroll(dw)
             self._sleep(interval)
 
     def _reset_mouse(self):
-        x_win, y_win, w_win, h_win = self.arlctr.config["region"]
+        x_win, y_win, w_win, h_win = self.arlctr.config.region
         x_ct, y_ct = (x_win + w_win // 2, y_win + h_win // 2)
-        pdi.keyDown("ctrl")
-        pdi.moveTo(x_ct, y_ct)
-        pdi.keyUp("ctrl")
+        self.inmgr.key_down("ctrl")
+        self.inmgr.move_to(x_ct, y_ct)
+        self.inmgr.key_up("ctrl")
 
     def _is_close_to_border(self, dx: int, dy: int, threshold: float) -> bool:
-        x_win, y_win, w_win, h_win = self.arlctr.config["region"]
+        x_win, y_win, w_win, h_win = self.arlctr.config.region
         x_max = x_win + w_win
         y_max = y_win + h_win
-        x_curr, y_curr = pdi.position()
+        x_curr, y_curr = self.inmgr.position()
         x, y = x_curr + dx, y_curr + dy
         return (abs(x - x_win) <= threshold or
                 abs(x - x_max) <= threshold or
@@ -146,23 +147,23 @@ class BotBase:
             if self._is_close_to_border(dx_next, dy_next, threshold=max(abs(dx_next), abs(dy_next))):
                 self._reset_mouse()
 
-            pdi.moveRel(dx_next, dy_next)
+            self.inmgr.move_rel(dx_next, dy_next)
             dx_sum += dx_next
             dy_sum += dy_next
             self._sleep(duration / steps * random.uniform(0.01, 0.02))
 
         if not self._check_event():
-            pdi.moveRel(dx - dx_sum, dy - dy_sum)
+            self.inmgr.move_rel(dx - dx_sum, dy - dy_sum)
 
-    def _capture_screen(self, force: bool = False):
-        if self.screen is None or force:
+    def _capture_screen(self, force: bool = False, delay: float = 1):
+        if self.frame is None or force:
             self._sleep(0.2)
-            self.screen = self.wdmgr.capture_screen()
+            self.frame = self.wdmgr.capture_screen(delay=delay)
 
     def _match(self, names: list[str]) -> tuple[bool, Match]:
-        if self.screen is None:
+        if self.frame is None:
             self._capture_screen()
-        match = self.arlctr.match_template(screen=self.screen, names=names)  # type: ignore
+        match = self.arlctr.match_template(screen=self.frame, names=names)  # type: ignore
         return match.name in names, match
 
     def _match_click(self, names: list[str]) -> bool:
@@ -174,8 +175,9 @@ class BotBase:
 
 
 class BotInPort(BotBase):
-    def __init__(self, event: Event, arlctr: AreaLocator, wdmgr: WindowManager):
-        super().__init__(event, arlctr, wdmgr)
+    def __init__(self, event: Event, arlctr: AreaLocator, wdmgr: WindowManager,
+                 inmgr: InputManager | None = None, clock: Clock | None = None):
+        super().__init__(event, arlctr, wdmgr, inmgr, clock)
 
         # step flags
         self.typed = False
@@ -184,15 +186,23 @@ class BotInPort(BotBase):
         self.deflaged = False
         self.debuffed = False
 
-    def _capture_screen(self, force: bool = False):
-        if self.screen is None or force:
+        # steps in order as (flag, action, names to verify the step)
+        self.steps = [("typed", self.select_type, ["coop_mode"]),
+                      ("selected", self.select_ship, ["battle_btn"]),
+                      ("equipped", self.select_equipment, ["flag_up_btn", "flag_down_btn"]),
+                      ("deflaged", self.remove_flag, ["flag_up_btn"]),
+                      ("debuffed", self.remove_buff, ["buff_up_btn"])]
+        self.verify_delay = 0.5
+
+    def _capture_screen(self, force: bool = False, delay: float = 1):
+        if self.frame is None or force:
             self._sleep(0.5)
-            self.screen = self.wdmgr.capture_screen()
+            self.frame = self.wdmgr.capture_screen(delay=delay)
 
     def _match(self, names: list[str]) -> tuple[bool, Match]:
-        if self.screen is None:
+        if self.frame is None:
             self._capture_screen()
-        match = self.arlctr.match_template(screen=self.screen, names=names)  # type: ignore
+        match = self.arlctr.match_template(screen=self.frame, names=names)  # type: ignore
         return match.name in names, match
 
     def _match_click(self, names: list[str]) -> bool:
@@ -202,6 +212,7 @@ class BotInPort(BotBase):
             self._click_xy(x + w // 2, y + h // 2)
         return flag
 
+    @timed()
     def close_page(self) -> None:
         """Try to close current page"""
         names = ["back_to_port_btn_1", "back_to_port_btn_2",
@@ -210,6 +221,7 @@ class BotInPort(BotBase):
             self._press_key("esc")
         log.info("Try to close page")
 
+    @timed()
     def select_type(self, type: str = "coop") -> bool:
         """Select battle type"""
         mode = f"{type}_mode"
@@ -219,7 +231,7 @@ class BotInPort(BotBase):
             flag, match = self._match(names=[mode])
             if flag:
                 return flag
-            x, y, w, h = self.arlctr.config["templates"][mode]["area"]
+            x, y, w, h = self.arlctr.config.templates[mode].area
             self._click_xy(x + w // 2, y + h // 2)
             self._capture_screen(force=True)  # a new type seelected page
             return self._match_click(names=[btn])
@@ -228,11 +240,12 @@ class BotInPort(BotBase):
             log.error(traceback.format_exc())
             return False
 
+    @timed()
     def select_ship(self) -> bool:
         """Select a ship"""
         try:
             log.info("Ship selecting...")
-            pos_ship = self.arlctr.config["positions"]["ship_in_port"]
+            pos_ship = self.arlctr.config.positions["ship_in_port"]
             self._move_to(*pos_ship)
             self._scroll("up", 20)  # scroll to top
             self._click()
@@ -241,17 +254,19 @@ class BotInPort(BotBase):
             log.error(traceback.format_exc())
             return False
 
+    @timed()
     def select_equipment(self) -> bool:
         """Select equipment"""
         try:
             log.info("Equipment selecting...")
-            pos_equip = self.arlctr.config["positions"]["equipment"]
+            pos_equip = self.arlctr.config.positions["equipment"]
             self._click_xy(*pos_equip)
             return True
         except Exception:
             log.error(traceback.format_exc())
             return False
 
+    @timed()
     def remove_flag(self) -> bool:
         """Remove flag"""
         try:
@@ -264,14 +279,15 @@ class BotInPort(BotBase):
             log.error(traceback.format_exc())
             return False
 
+    @timed()
     def remove_buff(self) -> bool:
         """Remove buff"""
         try:
             log.info("Buff removing...")
             self._match_click(names=["buff_fold_btn"])  # to show buff_btn
-            pos_buff_down_mod_btn = self.arlctr.config["positions"]["buff_down_mod_btn"]
+            pos_buff_down_mod_btn = self.arlctr.config.positions["buff_down_mod_btn"]
             self._click_xy(*pos_buff_down_mod_btn)  # use mod to remove buff
-            pos_buff_page_btn = self.arlctr.config["positions"]["buff_page_btn"]
+            pos_buff_page_btn = self.arlctr.config.positions["buff_page_btn"]
             self._click_xy(*pos_buff_page_btn, button="secondary")  # to show buff page
 
             self._capture_screen(force=True)  # a new page
@@ -283,45 +299,58 @@ class BotInPort(BotBase):
             log.error(traceback.format_exc())
             return False
 
+    @timed()
     def start_battle(self) -> bool:
         """Start battle"""
         try:
             log.info("Battle starting...")
             self._match_click(names=["battle_btn"])
-            pos_confirm_btn = self.arlctr.config["positions"]["confirm_btn"]
+            pos_confirm_btn = self.arlctr.config.positions["confirm_btn"]
             self._click_xy(*pos_confirm_btn)
             return True
         except Exception:
             log.error(traceback.format_exc())
             return False
 
+    def _verify(self, names: list[str]) -> bool:
+        """Capture a new screen and check it matches one of names"""
+        self._capture_screen(force=True, delay=self.verify_delay)
+        return self._match(names)[0]
+
+    def run_steps(self) -> None:
+        """
+        Run unfinished port steps in a chain and start battle
+        Each step is verified on a new screen before the next one runs,
+        otherwise the chain stops and continues on the next tick
+        """
+        for attr, action, names in self.steps:
+            if getattr(self, attr):
+                continue
+            if self._check_event():
+                return
+            if not action() or not self._verify(names):
+                log.info(f"Port step '{attr}' not verified, retry next tick")
+                return
+            setattr(self, attr, True)
+
+        if not self._verify(["battle_btn"]):
+            return
+        flag = self.start_battle()
+        for attr, action, names in self.steps:
+            setattr(self, attr, not flag)
+
+    @timed()
     def tick(self, match: Match) -> None:
         """Main execution tick for port state"""
         name = match.name
-        self.screen = match.screen
+        self.frame = match.frame
 
         names = ["rewards_btn", "login_btn"]
         if name in names:
             self._match_click(names)
 
         elif name == "battle_btn":
-            if not self.typed:
-                self.typed = self.select_type()
-            elif not self.selected:
-                self.selected = self.select_ship()
-            elif not self.equipped:
-                self.equipped = self.select_equipment()
-            elif not self.deflaged:
-                self.deflaged = self.remove_flag()
-            elif not self.debuffed:
-                self.debuffed = self.remove_buff()
-            else:
-                flag = self.start_battle()
-                self.typed = not flag
-                self.selected = not flag
-                self.equipped = not flag
-                self.deflaged = not flag
-                self.debuffed = not flag
+            self.run_steps()
 
         elif name in ["logining_1", "logining_2"]:
             log.info("Waiting for login...")
@@ -331,17 +360,26 @@ class BotInPort(BotBase):
 
 
 class BotInBattle(BotBase):
-    def __init__(self, event: Event, arlctr: AreaLocator, wdmgr: WindowManager):
-        super().__init__(event, arlctr, wdmgr)
+    def __init__(self, event: Event, arlctr: AreaLocator, wdmgr: WindowManager,
+                 inmgr: InputManager | None = None, clock: Clock | None = None):
+        super().__init__(event, arlctr, wdmgr, inmgr, clock)
 
         self.show = log.level == logging.DEBUG
-        self.timer_atpl = datetime.now()
+        self.timer_atpl = self.clock.now()
         self.interval_atpl = 50
         self.sight = 0.0
         self.enemies: list[tuple[float, float]] = [(0.0, 0.0)]
         self.sens_wide = 168 / (np.pi * 2)
         self.sens_narrow = 1009 / (np.pi * 2)
 
+        # closed-loop aiming
+        self.aim_tolerance = np.deg2rad(3)
+        self.aim_max_iter = 4
+        self.aim_learn_rate = 0.5
+        self.aim_settle_delay = 0.1  # seconds before each read after a move
+        self.aim_settle_reads = 3  # extra reads for the camera to stop turning
+        self.sens_range = (self.sens_wide / 4, self.sens_wide * 4)
+
     def set_minimap(self) -> None:
         """Set size of minimap middle"""
         self._press_key("-", presses=6, interval=0.01)
@@ -359,6 +397,7 @@ class BotInBattle(BotBase):
             self._press_key("m")
             self._sleep(0.2)
 
+    @timed()
     def set_autopilot(self) -> bool:
         """Set autopilot"""
         try:
@@ -366,13 +405,13 @@ class BotInBattle(BotBase):
             self.open_bigmap()
 
             self._capture_screen(force=True)  # a new page bigmap
-            if self.screen is not None:
-                if reds := self.arlctr.read_bigmap(screen=self.screen, show=self.show):
+            if self.frame is not None:
+                if reds := self.arlctr.read_bigmap(screen=self.frame, show=self.show):
                     # set a point random
                     self._click_xy(*random.choice(reds))
                 else:
                     # # set to middle
-                    # x, y, w, h = self.arlctr.config["region"]
+                    # x, y, w, h = self.arlctr.config.region
                     # self._click_xy(x + w // 2, y + h // 2)
                     self._press_key("w", 5)
             else:
@@ -382,23 +421,76 @@ class BotInBattle(BotBase):
             log.info("Autopilot set")
 
             # reset clock
-            self.timer_atpl = datetime.now() + timedelta(seconds=self.interval_atpl)
+            self.timer_atpl = self.clock.now() + timedelta(seconds=self.interval_atpl)
             return True
 
         except Exception:
             log.error(traceback.format_exc())
             return False
 
+    def _calc_sight(self, delta: np.ndarray) -> float:
+        """Calculate sight angle in radians from compass direction vector"""
+        sight = (0, -1)  # north
+        mag_delta = np.sqrt(delta[0]**2 + delta[1]**2)
+        mag_sight = np.sqrt(sight[0]**2 + sight[1]**2)
+        dot_product = delta[0] * sight[0] + delta[1] * sight[1]
+        cross_product = delta[0] * sight[1] - delta[1] * sight[0]
+        angle_cos = dot_product / (mag_delta * mag_sight)
+        angle_cos = np.clip(angle_cos, -1.0, 1.0)  # range in [-1, 1]
+        angle_rad = np.arccos(angle_cos)
+        angle_rad = -angle_rad if cross_product < 0 else angle_rad
+        return float((2 * np.pi - angle_rad) % (2 * np.pi))
+
+    def _read_sight(self) -> float | None:
+        """Capture a new screen and read current sight from compass"""
+        self._capture_screen(force=True, delay=self.aim_settle_delay)
+        if self.frame is None:
+            return None
+        delta = self.arlctr.read_compass(screen=self.frame, show=self.show)
+        if delta is None:
+            return None
+        return self._calc_sight(delta)
+
+    def _read_settled_sight(self) -> tuple[float | None, bool]:
+        """Read sight until two reads in a row agree, return the last read and if it settled"""
+        last = self._read_sight()
+        for i in range(self.aim_settle_reads):
+            if last is None:
+                break
+            sight = self._read_sight()
+            if sight is None:
+                break
+            if abs(self._wrap_angle(sight - last)) <= self.aim_tolerance / 2:
+                return sight, True
+            last = sight
+        return last, False
+
+    @staticmethod
+    def _wrap_angle(rad: float) -> float:
+        """Wrap angle into [-pi, pi)"""
+        return float((rad + np.pi) % (2 * np.pi) - np.pi)
+
+    def _learn_sens(self, pixel: int, moved: float) -> None:
+        """Update pixels-per-radian sensitivity from an observed move"""
+        # ignore moves too small to measure or turned the wrong way
+        if abs(moved) < self.aim_tolerance / 2 or np.sign(moved) != np.sign(pixel):
+            return
+        sens = pixel / moved
+        sens = (1 - self.aim_learn_rate) * self.sens_wide + self.aim_learn_rate * sens
+        self.sens_wide = float(np.clip(sens, *self.sens_range))
+        log.debug(f"Sensitivity updated to {self.sens_wide:.2f} px/rad")
+
+    @timed()
     def build_nautical_chart(self) -> bool:
         """Build nautical chart for enemy detection"""
         try:
             self._sleep(0.2)
             self._capture_screen()
-            if self.screen is None:
+            if self.frame is None:
                 return False
 
-            delta = self.arlctr.read_compass(screen=self.screen, show=self.show)
-            map_data = self.arlctr.read_minimap(screen=self.screen, show=self.show)
+            delta = self.arlctr.read_compass(screen=self.frame, show=self.show)
+            map_data = self.arlctr.read_minimap(screen=self.frame, show=self.show)
             if delta is None:
                 log.warning("Delta in compass not found")
                 return False
@@ -406,17 +498,7 @@ class BotInBattle(BotBase):
                 log.warning("Map data not found")
                 return False
 
-            # calculate sight
-            sight = (0, -1)  # north
-            mag_delta = np.sqrt(delta[0]**2 + delta[1]**2)
-            mag_sight = np.sqrt(sight[0]**2 + sight[1]**2)
-            dot_product = delta[0] * sight[0] + delta[1] * sight[1]
-            cross_product = delta[0] * sight[1] - delta[1] * sight[0]
-            angle_cos = dot_product / (mag_delta * mag_sight)
-            angle_cos = np.clip(angle_cos, -1.0, 1.0)  # range in [-1, 1]
-            angle_rad = np.arccos(angle_cos)
-            angle_rad = -angle_rad if cross_product < 0 else angle_rad
-            self.sight = (2 * np.pi - angle_rad) % (2 * np.pi)
+            self.sight = self._calc_sight(delta)
 
             # handle map_data
             p_self, polar = map_data.get("self", [])
@@ -443,19 +525,41 @@ class BotInBattle(BotBase):
     # def open_scope(self):
     #     if self.arlctr.check_scope(screen=self)
 
+    @timed()
     def search_enemy(self) -> None:
         """Search for the nearest enemy"""
         self.enemies.sort(key=lambda x: x[0])
         dist, rad = self.enemies[0]
         log.info(f"Cloest enemy found at distance {dist:.2f}, angle {np.rad2deg(rad):.2f}")
         log.info(f"Self sight {np.rad2deg(self.sight):.2f}")
-        diff = (rad - self.sight) % (2 * np.pi)
-        pixel = round(diff * self.sens_wide)
-        self._move_rel(pixel, 0)
+
+        # turn, re-read compass and correct the residual error
+        diff = self._wrap_angle(rad - self.sight)
+        moves = 0
+        for i in range(self.aim_max_iter):
+            if self._check_event() or abs(diff) <= self.aim_tolerance:
+                break
+            pixel = round(diff * self.sens_wide)
+            if pixel == 0:
+                break
+            self._move_rel(pixel, 0)
+            moves += 1
+            sight, settled = self._read_settled_sight()
+            if sight is None:
+                log.warning("Sight lost while aiming")
+                break
+            if settled:
+                self._learn_sens(pixel, self._wrap_angle(sight - self.sight))
+            else:
+                log.debug("Camera still turning, sensitivity not updated")
+            self.sight = sight
+            diff = self._wrap_angle(rad - self.sight)
+        log.info(f"Aimed with error {np.rad2deg(diff):.2f} after {moves} moves")
+
         self._move_rel(0, 24)
         self._move_rel(0, -8)
-        self._sleep(1)
 
+    @timed()
     def fire_weapon(self) -> None:
         """Fire weapons at enemy"""
         for k in random.sample(["f", "g", "c", "r", "t", "y", "u", "i"], 2):
@@ -472,21 +576,23 @@ class BotInBattle(BotBase):
             self._sleep(2)
             self._click(clicks=2)
 
+    @timed()
     def quit_battle(self) -> None:
         """Quit current battle"""
         self._press_key("esc")
         self._sleep(1)
         self._press_key("space")
 
+    @timed()
     def tick(self, match: Match) -> None:
         """Main execution tick for battle state"""
         name = match.name
-        self.screen = match.screen
+        self.frame = match.frame
 
         if name in ["map_mode", "b_btn"]:
             self.close_bigmap()
 
-        elif not self._match(["autopilot_on"])[0] and self.timer_atpl < datetime.now():
+        elif not self._match(["autopilot_on"])[0] and self.timer_atpl < self.clock.now():
             self.set_autopilot()
 
         elif self.build_nautical_chart():
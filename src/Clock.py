@@ -0,0 +1,59 @@
+# src/Clock.py
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+log = logging.getLogger(__name__)
+
+
+class Clock:
+    """Wall clock with sleeps interruptible by an event"""
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float | None, event: threading.Event | None = None) -> bool:
+        """Sleep for seconds or until event is set, return True if interrupted by event"""
+        if event is None:
+            time.sleep(seconds or 0)
+            return False
+        return event.wait(seconds)
+
+
+class VirtualClock(Clock):
+    """
+    Clock whose time only moves on sleep, to run hours of bot time in seconds
+    Sleeps return at once after advancing time, unless event is already set
+    """
+
+    def __init__(self, start: datetime | None = None):
+        self.start = start or datetime.now()
+        self.elapsed = 0.0
+        self.lock = threading.Lock()
+
+    def now(self) -> datetime:
+        return self.start + timedelta(seconds=self.elapsed)
+
+    def monotonic(self) -> float:
+        return self.elapsed
+
+    def advance(self, seconds: float):
+        """Move time forward by seconds, stopping short of datetime.max"""
+        with self.lock:
+            limit = (datetime.max - self.start).total_seconds() - 1
+            self.elapsed = min(self.elapsed + max(0.0, seconds), limit)
+
+    def sleep(self, seconds: float | None, event: threading.Event | None = None) -> bool:
+        if event is not None and event.is_set():
+            return True
+        self.advance(seconds or 0)
+        time.sleep(0)  # let other threads run
+        return event is not None and event.is_set()
+
+
+default_clock = Clock()
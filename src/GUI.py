@@ -1,6 +1,7 @@
 # src/GUI.py
 
 import logging
+import queue
 import tkinter as tk
 from tkinter import scrolledtext, messagebox
 from tkinter import ttk
@@ -11,19 +12,63 @@ from .HkMgr import HotkeyManager
 
 
 class TextHandler(logging.Handler):
-    def __init__(self, text_widget):
+    """
+    Queue-backed log handler for a Tk text widget
+    Records are drained in batches on a timer, consecutive repeats are coalesced,
+    records beyond max_queue are dropped and scrollback is capped to max_lines
+    """
+
+    def __init__(self, text_widget, interval: int = 200, max_lines: int = 1000,
+                 max_queue: int = 10000):
         super().__init__()
         self.text_widget = text_widget
+        self.interval = interval  # ms between drains
+        self.max_lines = max_lines
+        self.queue: queue.Queue[logging.LogRecord] = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.last_key = None  # key of last record shown
+        self.repeats = 0  # repeats of last record not shown yet
+        self.text_widget.after(self.interval, self.drain)
 
     def emit(self, record: logging.LogRecord):
-        msg = self.format(record)
-
-        def append():
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def drain(self):
+        lines = []
+        while True:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            key = (record.name, record.levelno, record.getMessage())
+            if key == self.last_key:
+                self.repeats += 1
+                continue
+            if self.repeats:
+                lines.append(f"(repeated {self.repeats} more times)")
+                self.repeats = 0
+            self.last_key = key
+            lines.append(self.format(record))
+
+        if self.repeats:
+            lines.append(f"(repeated {self.repeats} more times)")
+            self.repeats = 0
+        if self.dropped:
+            lines.append(f"({self.dropped} log records dropped)")
+            self.dropped = 0
+
+        if lines:
             self.text_widget.configure(state=tk.NORMAL)
-            self.text_widget.insert(tk.END, msg + "\n")
+            self.text_widget.insert(tk.END, "\n".join(lines) + "\n")
+            count = int(self.text_widget.index("end-1c").split(".")[0])
+            if count > self.max_lines:
+                self.text_widget.delete("1.0", f"{count - self.max_lines + 1}.0")
             self.text_widget.configure(state=tk.DISABLED)
             self.text_widget.see(tk.END)
-        self.text_widget.after(0, append)
+        self.text_widget.after(self.interval, self.drain)
 
 
 class MainGUI:
@@ -363,8 +408,8 @@ class MainGUI:
 
         self.var_scheduled_tasks_enabled.set(self.scheduled_tasks.get("enabled", False))
 
-    def setup_logging(self, level: str = "INFO"):
-        handler = TextHandler(self.text_log)
+    def setup_logging(self, level: str = "INFO", max_lines: int = 1000):
+        handler = TextHandler(self.text_log, max_lines=max_lines)
         formatter = logging.Formatter("<%(asctime)s>[%(name)s](%(levelname)s):\n%(message)s")
         handler.setFormatter(formatter)
         logging.getLogger().addHandler(handler)
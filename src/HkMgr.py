@@ -5,6 +5,8 @@ import threading
 
 import keyboard
 
+from .Clock import Clock, default_clock
+
 
 log = logging.getLogger(__name__)
 
@@ -14,22 +16,32 @@ class HotkeyManager:
         self.running = False
         self.should_exit = False
         self.lock = threading.Lock()
+        self.changed = threading.Event()  # set on any state change
 
     def script_start(self):
         with self.lock:
             self.running = True
+            self.changed.set()
             log.debug(f"Script is now running")
 
     def script_stop(self):
         with self.lock:
             self.running = False
+            self.changed.set()
             log.debug(f"Script is now stopped")
 
     def script_exit(self):
         with self.lock:
             self.should_exit = True
+            self.changed.set()
         log.debug("Exiting script...")
 
+    def wait_changed(self, timeout: float | None = None, clock: Clock | None = None) -> bool:
+        """Wait until state changes or timeout, return True if changed"""
+        changed = (clock or default_clock).sleep(timeout, event=self.changed)
+        self.changed.clear()
+        return changed
+
     def start_listener(self):
         keyboard.add_hotkey("F10", self.script_start)
         keyboard.add_hotkey("F11", self.script_stop)
@@ -0,0 +1,47 @@
+# src/InMgr.py
+
+import logging
+
+try:
+    import pydirectinput as pdi
+    import win32api
+    import win32con
+    pdi.FAILSAFE = False
+except ImportError:  # not on Windows, only simulated input is available
+    pdi = None
+
+log = logging.getLogger(__name__)
+
+
+class InputManager:
+    """Mouse and keyboard input sent to the game through DirectInput"""
+
+    def __init__(self):
+        if pdi is None:
+            raise RuntimeError("pydirectinput and pywin32 are required for game input")
+
+    def position(self) -> tuple[int, int]:
+        x, y = pdi.position()
+        return x, y
+
+    def move_to(self, x: int, y: int):
+        pdi.moveTo(x, y)
+
+    def move_rel(self, dx: int, dy: int):
+        pdi.moveRel(dx, dy)
+
+    def mouse_down(self, button: str = "primary", duration: float = 0.1):
+        pdi.mouseDown(button=button, duration=duration)
+
+    def mouse_up(self, button: str = "primary", duration: float = 0.1):
+        pdi.mouseUp(button=button, duration=duration)
+
+    def key_down(self, key: str):
+        pdi.keyDown(key)
+
+    def key_up(self, key: str):
+        pdi.keyUp(key)
+
+    def scroll(self, dw: int):
+        """Scroll mouse wheel by dw, 120 per notch"""
+        win32api.mouse_event(win32con.MOUSEEVENTF_WHEEL, 0, 0, dw, 0)
@@ -3,17 +3,24 @@
 import logging
 import os
 import sys
-import time
 import traceback
 import threading
-from datetime import datetime
+from bisect import bisect_right
+from datetime import datetime, time as dtime, timedelta
 
-import pygetwindow as gw
+try:
+    import pygetwindow as gw
+except ImportError:  # not on Windows, only simulated windows are available
+    gw = None
 
-from .ArLctr import AreaLocator, Match, load_config, load_user
+from .ArLctr import AreaLocator, Match, area_tracker, load_config, load_user
 from .HkMgr import HotkeyManager
 from .WinMgr import WindowManager
+from .InMgr import InputManager
 from .Bot import BotInPort, BotInBattle
+from .StPvdr import StateProvider, load_api
+from .Clock import Clock, default_clock
+from .PfMon import monitor, set_instance, timed, tracer
 
 log = logging.getLogger(__name__)
 
@@ -23,13 +30,17 @@ class TaskManager:
     Simplified task manager that handles scheduled tasks with unified logic
     """
 
-    def __init__(self):
+    def __init__(self, clock: Clock | None = None):
         self.enabled = False
         self.tasks = []
         self.battle_counts = {}  # Track battles per task
         self._task_ids = []  # Track task IDs for consistent counting
         # allow injecting time provider for easier testing (returns datetime)
-        self._now = datetime.now
+        self._now = (clock or default_clock).now
+        # timeline of a day: sorted transition instants (microseconds since midnight)
+        # and the indices of tasks active from each instant until the next one
+        self._points: list[int] = [0]
+        self._actives: list[tuple[int, ...]] = [()]
 
     def load_tasks(self, data: dict):
         """Load tasks from user configuration"""
@@ -37,6 +48,8 @@ class TaskManager:
         self.tasks = []
         self._task_ids = []
         self.battle_counts = {}
+        self._points = [0]
+        self._actives = [()]
 
         if not self.enabled:
             return
@@ -75,35 +88,61 @@ class TaskManager:
                 log.warning(f"Invalid scheduled task {task_data}, error: {e}")
                 continue
 
-    def is_running_time(self):
-        """Check if current time is within any task's running time"""
-        if not self.enabled or not self.tasks:
-            return False
+        self._compile_timeline()
 
-        current_time = self._now().time()
+    @staticmethod
+    def _to_us(t: dtime) -> int:
+        """Convert time of day to microseconds since midnight"""
+        return ((t.hour * 60 + t.minute) * 60 + t.second) * 10**6 + t.microsecond
 
-        for task in self.tasks:
-            start_time = task["start"]
-            end_time = task["end"]
-
-            # Handle time ranges that cross midnight
-            if start_time <= end_time:
-                if start_time <= current_time <= end_time:
-                    return True
+    def _compile_timeline(self):
+        """Compile tasks into sorted transition instants of a day"""
+        day = 24 * 3600 * 10**6
+        spans = []  # half-open [begin, end) spans with task index
+        for i, task in enumerate(self.tasks):
+            start = self._to_us(task["start"])
+            end = self._to_us(task["end"]) + 1  # end time is inclusive
+            if start < end:
+                spans.append((start, end, i))
             else:  # Crosses midnight
-                if current_time >= start_time or current_time <= end_time:
-                    return True
+                spans.append((start, day, i))
+                spans.append((0, end, i))
+
+        points = sorted({0} | {p for span in spans for p in span[:2] if p < day})
+        self._points = []
+        self._actives = []
+        for p in points:
+            active = tuple(i for begin, end, i in spans if begin <= p < end)
+            # merge instants that do not change active tasks
+            if self._actives and self._actives[-1] == active:
+                continue
+            self._points.append(p)
+            self._actives.append(active)
 
-        return False
+    def active_tasks(self, now: datetime | None = None) -> tuple[int, ...]:
+        """Return indices of tasks active at now"""
+        if not self.enabled or not self.tasks:
+            return ()
+        now = now or self._now()
+        idx = bisect_right(self._points, self._to_us(now.time())) - 1
+        return self._actives[idx]
+
+    def next_transition(self, now: datetime | None = None) -> datetime | None:
+        """Return next time when active tasks change, None if they never do"""
+        if not self.enabled or not self.tasks or len(self._points) <= 1:
+            return None
+        now = now or self._now()
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        idx = bisect_right(self._points, self._to_us(now.time()))
+        if idx < len(self._points):
+            return midnight + timedelta(microseconds=self._points[idx])
+        # wrap to tomorrow, skipping midnight if it does not change active tasks
+        idx = 1 if self._actives[0] == self._actives[-1] else 0
+        return midnight + timedelta(days=1, microseconds=self._points[idx])
 
-    def _is_task_active(self, task: dict, current_time) -> bool:
-        """Helper: return True if given task is active at current_time"""
-        start_time = task["start"]
-        end_time = task["end"]
-        if start_time <= end_time:
-            return start_time <= current_time <= end_time
-        else:  # Crosses midnight
-            return current_time >= start_time or current_time <= end_time
+    def is_running_time(self):
+        """Check if current time is within any task's running time"""
+        return len(self.active_tasks()) > 0
 
     def should_continue_running(self, in_battle=False):
         """
@@ -118,17 +157,10 @@ class TaskManager:
         if in_battle:
             return True
 
-        # If current time is not in any task time window, do not run
-        if not self.is_running_time():
-            return False
-
-        current_time = self._now().time()
         # Continue running only if there exists at least one active task
         # that still has remaining battle quota
-        for i, task in enumerate(self.tasks):
-            if not self._is_task_active(task, current_time):
-                continue
-
+        for i in self.active_tasks():
+            task = self.tasks[i]
             task_id = self._task_ids[i] if i < len(self._task_ids) else i
             battles_done = self.battle_counts.get(task_id, 0)
             max_battles = int(task.get("max_battles", 0))
@@ -142,12 +174,8 @@ class TaskManager:
         """Record that a battle has been completed"""
         if not self.enabled:
             return
-        current_time = self._now().time()
         # Increment battle count for all active tasks
-        for i, task in enumerate(self.tasks):
-            if not self._is_task_active(task, current_time):
-                continue
-
+        for i in self.active_tasks():
             task_id = self._task_ids[i] if i < len(self._task_ids) else i
             self.battle_counts[task_id] = self.battle_counts.get(task_id, 0) + 1
             log.debug(f"Task {task_id} recorded battle. Count now: {self.battle_counts[task_id]}")
@@ -180,29 +208,44 @@ class TaskManager:
 class GameInstance:
     """Wrapper class for a game instance"""
 
-    def __init__(self, idx: int, window: gw.Win32Window, region: tuple[int, int, int, int]):
+    def __init__(self, idx: int, window: "gw.Win32Window", region: tuple[int, int, int, int],
+                 wdmgr: WindowManager | None = None, inmgr: InputManager | None = None,
+                 clock: Clock | None = None):
         self.idx = idx
         self.window = window
         self.region = region
-        self.wdmgr: WindowManager | None = None
+        self.wdmgr: WindowManager | None = wdmgr  # injected by simulator, created on initialize otherwise
+        self.inmgr: InputManager | None = inmgr
         self.alctr: AreaLocator | None = None
         self.portbot: BotInPort | None = None
         self.battlebot: BotInBattle | None = None
+        self.stpvdr: StateProvider | None = None
+        self.clock = clock or default_clock
         self.event_stop = threading.Event()
-        self.task_manager = TaskManager()  # Use simplified task manager
+        self.task_manager = TaskManager(clock=self.clock)  # Use simplified task manager
         self.in_battle = False  # Track if we're currently in battle
+        self.resume_at: datetime | None = None  # Paused until next scheduled window
         self.initialized = False
 
     def initialize(self) -> bool:
         """Initialize game instance"""
         try:
-            self.wdmgr = WindowManager(region=self.region, window=self.window)
+            if self.wdmgr is None:
+                self.wdmgr = WindowManager(region=self.region, window=self.window,
+                                           event=self.event_stop, clock=self.clock)
             self.wdmgr.set_window_borderless()
             self.alctr = AreaLocator(win_title=self.window.title)
             if self.alctr and self.alctr.user:
                 self.task_manager.load_tasks(data=self.alctr.user["scheduled_tasks"])
-            self.portbot = BotInPort(event=self.event_stop, arlctr=self.alctr, wdmgr=self.wdmgr)
-            self.battlebot = BotInBattle(event=self.event_stop, arlctr=self.alctr, wdmgr=self.wdmgr)
+            if self.inmgr is None:
+                self.inmgr = InputManager()
+            self.portbot = BotInPort(event=self.event_stop, arlctr=self.alctr,
+                                     wdmgr=self.wdmgr, inmgr=self.inmgr, clock=self.clock)
+            self.battlebot = BotInBattle(event=self.event_stop, arlctr=self.alctr,
+                                         wdmgr=self.wdmgr, inmgr=self.inmgr, clock=self.clock)
+            api = load_api(config=self.alctr.config, win_title=self.window.title)
+            stale = self.alctr.config.mod_data.get("stale", 10)
+            self.stpvdr = StateProvider(alctr=self.alctr, api=api, stale=stale)
             self.initialized = True
             log.info(f"Game instance {self.idx} for {self.window.title} initialized")
             return True
@@ -215,10 +258,13 @@ class GameInstance:
         """Cleanup game instance"""
         try:
             self.event_stop.set()
+            if self.stpvdr and self.stpvdr.api:
+                self.stpvdr.api.close()
             self.wdmgr = None
             self.alctr = None
             self.portbot = None
             self.battlebot = None
+            self.stpvdr = None
             self.initialized = False
             log.info(f"Game instance {self.idx} for {self.window.title} cleaned up")
         except Exception:
@@ -227,30 +273,43 @@ class GameInstance:
 
 
 class MainController:
-    def __init__(self, hkmgr: HotkeyManager):
+    def __init__(self, hkmgr: HotkeyManager, clock: Clock | None = None):
         self.hkmgr = hkmgr
+        self.clock = clock or default_clock
         self.running = False
         self.stop_event = threading.Event()
 
         self.event_stop = threading.Event()
-        self.task_manager = TaskManager()  # Use simplified task manager
+        self.task_manager = TaskManager(clock=self.clock)  # Use simplified task manager
         self.in_battle = False  # Track if we're currently in battle
 
-    def setup_instances(self):
-        """Set up game instances"""
-        config = load_config(os.path.join("resources", "config.json"))
-        user = load_user(os.path.join("resources", "user.json"))
-        titles = list(user["title_lang_map"].keys())
+    def find_windows(self, titles: list[str]) -> list["gw.Win32Window"]:
+        """Find game windows by titles"""
         windows: list[gw.Win32Window] = []
         for t in titles:
             ws: list[gw.Win32Window] = gw.getWindowsWithTitle(t)
             windows.extend(ws)
+        return windows
+
+    def create_instance(self, idx: int, window: "gw.Win32Window",
+                        region: tuple[int, int, int, int]) -> GameInstance:
+        """Create a game instance for a window"""
+        return GameInstance(idx=idx, window=window, region=region, clock=self.clock)
+
+    def setup_instances(self):
+        """Set up game instances"""
+        config = load_config(os.path.join("resources", "config.json"))
+        user = load_user(os.path.join("resources", "user.json"))
+        monitor.configure(**config.perf)
+        tracer.configure(**config.trace)
+        area_tracker.configure(region=(config.region.w, config.region.h), **config.adaptive_areas)
+        windows = self.find_windows(titles=list(user["title_lang_map"].keys()))
         if len(windows) <= 0:
             raise RuntimeError("No game windows found")
 
         self.instances: list[GameInstance] = []
         for i, w in enumerate(windows):
-            instance = GameInstance(idx=i, window=w, region=tuple(config["region"]))
+            instance = self.create_instance(idx=i, window=w, region=tuple(config.region))
             if instance.initialize():  # 初始化实例
                 self.instances.append(instance)
             else:
@@ -276,10 +335,16 @@ class MainController:
     def on_stop(self):
         """Stop game instances"""
         log.info("Stopping multi-controller")
-        for inst in self.instances:
+        for inst in getattr(self, "instances", []):
             inst.cleanup()
         self.instances = []
         self.running = False
+        if monitor.enabled:
+            monitor.export()
+        if tracer.enabled:
+            tracer.export()
+        if area_tracker.enabled:
+            area_tracker.save()
         log.info("Multi-controller stopped")
 
     def run(self):
@@ -294,8 +359,10 @@ class MainController:
 
                 if self.running:
                     self._main_loop_iteration()
+                    monitor.maybe_export()
 
-                time.sleep(1)  # Slow down loop
+                # Slow down loop, or sleep until the next scheduled window if all paused
+                self.hkmgr.wait_changed(timeout=self._idle_timeout(), clock=self.clock)
         except KeyboardInterrupt:
             log.info("Multi-controller interrupted by user")
         except Exception as e:
@@ -305,12 +372,26 @@ class MainController:
             self.on_stop()
             log.info("Multi-controller exited")
 
+    def _idle_timeout(self) -> float:
+        """Seconds to wait before next iteration"""
+        instances = [inst for inst in getattr(self, "instances", [])
+                     if inst.initialized and not inst.event_stop.is_set()]
+        if not self.running or not instances:
+            return 1
+        if not all(inst.resume_at for inst in instances):
+            return 1
+        resume_at = min(inst.resume_at for inst in instances)  # type: ignore
+        wait = (resume_at - self.clock.now()).total_seconds()
+        return max(1, min(wait, threading.TIMEOUT_MAX))
+
+    @timed()
     def _main_loop_iteration(self):
         """Handle multi iteration of the loop"""
         for inst in self.instances:
             if not inst.initialized or inst.event_stop.is_set():
                 continue
 
+            set_instance(inst.idx)
             try:
                 # Check if to stop
                 if self.stop_event.is_set() or not self.hkmgr.running:
@@ -318,24 +399,29 @@ class MainController:
                         self.on_stop()
                     return
 
+                # Skip paused instance until its next scheduled window
+                if inst.resume_at is not None:
+                    if inst.task_manager._now() < inst.resume_at:
+                        continue
+                    inst.resume_at = None
+
                 # Check scheduled tasks: pause instance if not allowed to run now
                 # Instead of stopping the instance, we just skip processing and continue the loop
                 if not inst.task_manager.should_continue_running(in_battle=inst.in_battle):
                     log.info(f"Instance {inst.idx} scheduled tasks disallow running now or quota exhausted")
-                    log.info(f"waiting for next scheduled task")
-                    # Add a sleep to avoid busy-waiting
-                    time.sleep(5)
+                    inst.resume_at = inst.task_manager.next_transition() or datetime.max
+                    log.info(f"waiting for next scheduled task at {inst.resume_at}")
                     continue
 
                 # Capture screen
                 if inst.wdmgr is None:
                     continue
-                screen = inst.wdmgr.capture_screen()
+                frame = inst.wdmgr.capture_screen()
 
-                # Template matching
-                if inst.alctr is None:
+                # Game state from mod data or template matching
+                if inst.stpvdr is None:
                     continue
-                match = inst.alctr.match_template(screen)
+                match = inst.stpvdr.get_state(frame)
                 name = match.name
 
                 # Process game state
@@ -345,6 +431,7 @@ class MainController:
                 log.error(f"Error in main loop iteration processing instance {inst.idx}")
                 log.error(traceback.format_exc())
 
+    @timed()
     def _process_game_state(self, instance: GameInstance, state_name: str, match: Match):
         """Process game state and take appropriate actions"""
         if instance.event_stop.is_set():
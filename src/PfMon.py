@@ -0,0 +1,199 @@
+# src/PfMon.py
+
+import csv
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def set_instance(idx: int | str):
+    """Set instance of stages recorded in current thread"""
+    _local.instance = str(idx)
+
+
+def get_instance() -> str:
+    return getattr(_local, "instance", "-")
+
+
+class Histogram:
+    """Latency histogram with log-spaced buckets"""
+
+    low = 1e-6  # seconds of the first bucket
+    growth = 1.05  # ratio between bucket bounds, about 5% error of percentiles
+    size = 430  # buckets up to about 1e3 seconds
+
+    def __init__(self):
+        self.counts = [0] * self.size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        if seconds <= self.low:
+            idx = 0
+        else:
+            idx = min(self.size - 1, int(math.log(seconds / self.low, self.growth)) + 1)
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        """Return the upper bound in seconds of the bucket holding percentile q"""
+        if self.count <= 0:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n > 0:
+                return min(self.max, self.low * self.growth ** idx)
+        return self.max
+
+    def summary(self) -> dict[str, float]:
+        """Return summary in milliseconds"""
+        return {"count": self.count,
+                "mean": self.total / self.count * 1000 if self.count else 0.0,
+                "p50": self.percentile(50) * 1000,
+                "p95": self.percentile(95) * 1000,
+                "p99": self.percentile(99) * 1000,
+                "max": self.max * 1000}
+
+
+class PerfMonitor:
+    """
+    Per-instance latency histograms of pipeline stages, exported periodically
+    Recording is skipped entirely while disabled
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.path = os.path.join("logs", "perf.json")
+        self.interval = 60.0  # seconds between exports
+        self.exported = time.monotonic()
+        self.histograms: dict[tuple[str, str], Histogram] = {}
+        self.lock = threading.Lock()
+
+    def configure(self, enabled: bool = False, path: str | None = None, interval: float | None = None):
+        self.enabled = enabled
+        self.path = path or self.path
+        self.interval = interval or self.interval
+        if enabled:
+            log.info(f"Perf monitor enabled, exporting to {self.path}")
+
+    def record(self, stage: str, seconds: float, instance: str | None = None):
+        key = (instance or get_instance(), stage)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.record(seconds)
+
+    def summary(self) -> dict[str, dict[str, dict[str, float]]]:
+        """Return {instance: {stage: summary}}"""
+        with self.lock:
+            items = sorted(self.histograms.items())
+        data: dict[str, dict[str, dict[str, float]]] = {}
+        for (instance, stage), hist in items:
+            data.setdefault(instance, {})[stage] = hist.summary()
+        return data
+
+    def export(self):
+        """Write summary to a json or csv file by suffix of path"""
+        self.exported = time.monotonic()
+        data = self.summary()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if self.path.endswith(".csv"):
+            fields = ["instance", "stage", "count", "mean", "p50", "p95", "p99", "max"]
+            with open(self.path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=fields)
+                writer.writeheader()
+                for instance, stages in data.items():
+                    for stage, summary in stages.items():
+                        writer.writerow({"instance": instance, "stage": stage, **summary})
+        else:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"time": time.time(), "instances": data}, f, indent=2)
+
+    def maybe_export(self):
+        """Export if enabled and interval elapsed"""
+        if self.enabled and time.monotonic() - self.exported >= self.interval:
+            try:
+                self.export()
+            except OSError as e:
+                log.warning(f"Failed to export perf data, {e}")
+
+
+class Tracer:
+    """
+    Nested spans of threads recorded as Chrome trace events
+    The exported json can be opened in Perfetto or chrome://tracing
+    """
+
+    def __init__(self, max_events: int = 200000):
+        self.enabled = False
+        self.path = os.path.join("logs", "trace.json")
+        self.events: deque[dict] = deque(maxlen=max_events)  # oldest dropped when full
+        self.threads: dict[int, str] = {}  # thread id -> name
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+
+    def configure(self, enabled: bool = False, path: str | None = None):
+        self.enabled = enabled
+        self.path = path or self.path
+        if enabled:
+            log.info(f"Tracer enabled, exporting to {self.path}")
+
+    def add(self, name: str, start: float, end: float, instance: str | None = None):
+        """Add a span between perf_counter start and end"""
+        tid = threading.get_ident()
+        if tid not in self.threads:
+            self.threads[tid] = threading.current_thread().name
+        self.events.append({"name": name, "ph": "X", "pid": self.pid, "tid": tid,
+                            "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6,
+                            "args": {"instance": instance or get_instance()}})
+
+    def export(self):
+        """Write spans as Chrome trace-event json"""
+        meta = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                 "args": {"name": name}} for tid, name in list(self.threads.items())]
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": meta + list(self.events), "displayTimeUnit": "ms"}, f)
+        log.info(f"Exported {len(self.events)} trace events to {self.path}")
+
+
+monitor = PerfMonitor()
+tracer = Tracer()
+
+
+def timed(stage: str | None = None):
+    """Decorator recording latency of a function as a stage and a trace span"""
+    def decorator(func):
+        name = stage or func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not (monitor.enabled or tracer.enabled):
+                return func(*args, **kwargs)
+            instance = get_instance()
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                if monitor.enabled:
+                    monitor.record(name, end - start, instance)
+                if tracer.enabled:
+                    tracer.add(name, start, end, instance)
+        return wrapper
+    return decorator
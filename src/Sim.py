@@ -0,0 +1,265 @@
+# src/Sim.py
+"""
+Headless game simulator for end-to-end runs without the game
+
+A scripted state machine port -> queue -> loading -> battle -> result renders
+screenshots from the templates and reacts to the simulated input, so that
+MainController runs unchanged on any platform.
+"""
+
+import logging
+import os
+import random
+from dataclasses import dataclass
+from threading import Event
+
+import numpy as np
+
+from .ArLctr import load_config, load_template_image, load_user, template_cache_dir
+from .Clock import Clock, default_clock
+from .HkMgr import HotkeyManager
+from .MCtrl import GameInstance, MainController
+from .WinMgr import Frame, WindowManager
+from .InMgr import InputManager
+from .PfMon import timed
+
+log = logging.getLogger(__name__)
+
+STAGES = ["port", "queue", "loading", "battle", "result"]
+
+# templates shown on the screen of each stage
+SCREENS = {
+    "port": ["battle_btn", "coop_mode", "flag_up_btn", "buff_up_btn"],
+    "queue": ["battle_queue"],
+    "loading": ["battle_loading"],
+    "battle": ["battle_began", "autopilot_on"],
+    "result": ["shift_btn"],
+}
+
+# seconds of stages that end by themselves
+DURATIONS = {"queue": 5, "loading": 10, "battle": 600}
+
+
+@dataclass
+class SimWindow:
+    """Stand-in of a game window"""
+    title: str
+
+
+class SimGame:
+    """Scripted game state machine rendering screenshots from templates"""
+
+    def __init__(self, title: str, region: tuple[int, int, int, int],
+                 durations: dict[str, float] | None = None, drop_rate: float = 0.0,
+                 stuck_timeout: float = 60, seed: int | None = None, clock: Clock | None = None):
+        self.region = region
+        self.clock = clock or default_clock
+        self.durations = {**DURATIONS, **(durations or {})}
+        self.drop_rate = drop_rate  # chance of a click lost, to exercise retries
+        self.stuck_timeout = stuck_timeout
+        self.random = random.Random(seed)
+
+        self.images, self.areas = self.load_templates(title)
+        _, _, w, h = region
+        rng = np.random.default_rng(seed)
+        self.background = rng.integers(0, 48, size=(h, w, 3), dtype=np.uint8)
+
+        self.bigmap = False
+        self.stage = "port"
+        self.since = self.clock.monotonic()
+        self.started = self.since
+        self.history: list[tuple[str, float]] = []  # (stage, seconds stayed) of left stages
+        self.rects: dict[str, tuple[int, int, int, int]] = {}
+        log.info(f"Simulated game {title} started in port")
+
+    def load_templates(self, title: str) -> tuple[dict[str, np.ndarray], dict[str, tuple]]:
+        """Load template images and areas of the window language"""
+        config = load_config(os.path.join("resources", "config.json"))
+        user = load_user(os.path.join("resources", "user.json"))
+        language = user["title_lang_map"][title]
+        cache_dir = template_cache_dir(config, language)
+        images = {}
+        areas = {}
+        for name, spec in config.templates.items():
+            path = os.path.join("resources", "templates", language, f"{name}.png")
+            image = load_template_image(path, config.template_scale, cache_dir)
+            if image is None:
+                continue
+            images[name] = image
+            areas[name] = tuple(spec.area)
+        missing = {n for names in SCREENS.values() for n in names} - images.keys()
+        if missing:
+            raise FileNotFoundError(f"Templates {sorted(missing)} not found for {language}")
+        return images, areas
+
+    def _enter(self, stage: str):
+        now = self.clock.monotonic()
+        self.history.append((self.stage, now - self.since))
+        log.debug(f"Simulated stage {self.stage} -> {stage} after {now - self.since:.1f}s")
+        self.stage = stage
+        self.since = now
+        self.bigmap = False
+
+    def _advance(self):
+        """Leave timed stages whose duration elapsed"""
+        while self.stage in self.durations:
+            if self.clock.monotonic() - self.since < self.durations[self.stage]:
+                break
+            idx = (STAGES.index(self.stage) + 1) % len(STAGES)
+            self._enter(STAGES[idx])
+
+    def frame(self, out: np.ndarray | None = None) -> np.ndarray:
+        """Render screenshot of current stage, into out if given"""
+        self._advance()
+        names = list(SCREENS[self.stage])
+        if self.stage == "battle" and self.bigmap:
+            names.append("map_mode")
+
+        if out is None:
+            out = np.empty_like(self.background)
+        np.copyto(out, self.background)
+        screen = out
+        self.rects = {}
+        for name in names:
+            image = self.images.get(name)
+            if image is None:
+                continue
+            x, y, _, _ = self.areas[name]
+            h, w = image.shape[:2]
+            screen[y:y + h, x:x + w] = image
+            self.rects[name] = (x, y, w, h)
+        return screen
+
+    def _hit(self, name: str, x: int, y: int) -> bool:
+        if name not in self.rects:
+            return False
+        rx, ry, rw, rh = self.rects[name]
+        x_win, y_win, _, _ = self.region
+        return rx <= x - x_win < rx + rw and ry <= y - y_win < ry + rh
+
+    def click(self, x: int, y: int, button: str = "primary"):
+        """React to a mouse click at screen point(x, y)"""
+        if self.random.random() < self.drop_rate:
+            log.debug(f"Simulated click at ({x}, {y}) dropped")
+            return
+        self._advance()
+        if self.stage == "port" and button == "primary" and self._hit("battle_btn", x, y):
+            self._enter("queue")
+
+    def press(self, key: str):
+        """React to a key press"""
+        self._advance()
+        if self.stage == "battle" and key == "m":
+            self.bigmap = not self.bigmap
+        elif self.stage == "result" and key == "space":
+            self._enter("port")
+
+    def stats(self) -> dict:
+        """Throughput and stuck-state stats since start"""
+        now = self.clock.monotonic()
+        elapsed = now - self.started
+        stays = self.history + [(self.stage, now - self.since)]
+        battles = sum(1 for stage, _ in self.history if stage == "battle")
+        ports = [t for stage, t in self.history if stage == "port"]
+        stuck = [stage for stage, t in stays
+                 if t > self.durations.get(stage, 0) + self.stuck_timeout]
+        return {
+            "elapsed": elapsed,
+            "battles": battles,
+            "battles_per_hour": battles / elapsed * 3600 if elapsed > 0 else 0.0,
+            "port_turnaround": sum(ports) / len(ports) if ports else None,
+            "port_turnaround_max": max(ports) if ports else None,
+            "stuck": len(stuck),
+            "stuck_rate": len(stuck) / len(stays),
+            "stage": self.stage,
+        }
+
+
+class SimWindowManager(WindowManager):
+    """Capture source serving frames of a simulated game"""
+
+    def __init__(self, game: SimGame, window: SimWindow, event: Event | None = None):
+        super().__init__(region=game.region, window=window, event=event, clock=game.clock)
+        self.game = game
+
+    def set_window_borderless(self):
+        pass
+
+    def check_window(self):
+        pass
+
+    @timed()
+    def grab(self) -> Frame:
+        frame = self.pool.acquire()
+        self.game.frame(out=frame.array)
+        return frame
+
+
+class SimInputManager(InputManager):
+    """Input backend delivering mouse and keyboard events to a simulated game"""
+
+    def __init__(self, game: SimGame):
+        self.game = game
+        x, y, w, h = game.region
+        self.x, self.y = x + w // 2, y + h // 2
+
+    def position(self) -> tuple[int, int]:
+        return self.x, self.y
+
+    def move_to(self, x: int, y: int):
+        self.x, self.y = x, y
+
+    def move_rel(self, dx: int, dy: int):
+        self.x, self.y = self.x + dx, self.y + dy
+
+    def mouse_down(self, button: str = "primary", duration: float = 0.1):
+        self.game.clock.sleep(duration)
+
+    def mouse_up(self, button: str = "primary", duration: float = 0.1):
+        self.game.clock.sleep(duration)
+        self.game.click(self.x, self.y, button=button)
+
+    def key_down(self, key: str):
+        pass
+
+    def key_up(self, key: str):
+        self.game.press(key)
+
+    def scroll(self, dw: int):
+        pass
+
+
+class SimController(MainController):
+    """MainController driving simulated games instead of windows"""
+
+    def __init__(self, hkmgr: HotkeyManager, lang: str = "en_us", instances: int = 1,
+                 schedule: bool = False, clock: Clock | None = None, **game_kwargs):
+        super().__init__(hkmgr, clock=clock)
+        self.lang = lang
+        self.n_instances = instances
+        self.schedule = schedule  # follow scheduled tasks of user.json
+        self.game_kwargs = game_kwargs
+        self.games: list[SimGame] = []
+
+    def find_windows(self, titles: list[str]) -> list[SimWindow]:
+        user = load_user(os.path.join("resources", "user.json"))
+        titles = [t for t in titles if user["title_lang_map"][t] == self.lang]
+        if not titles:
+            raise ValueError(f"No window title for language {self.lang}")
+        return [SimWindow(title=titles[0]) for _ in range(self.n_instances)]
+
+    def create_instance(self, idx: int, window: SimWindow,
+                        region: tuple[int, int, int, int]) -> GameInstance:
+        game = SimGame(title=window.title, region=region, clock=self.clock, **self.game_kwargs)
+        self.games.append(game)
+        instance = GameInstance(idx=idx, window=window, region=region, clock=self.clock,
+                                inmgr=SimInputManager(game=game))
+        instance.wdmgr = SimWindowManager(game=game, window=window, event=instance.event_stop)
+        return instance
+
+    def setup_instances(self):
+        self.games = []
+        super().setup_instances()
+        if not self.schedule:
+            for inst in self.instances:
+                inst.task_manager.load_tasks(data={"enabled": False})
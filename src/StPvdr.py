@@ -0,0 +1,79 @@
+# src/StPvdr.py
+
+import logging
+import time
+
+import numpy as np
+
+from .API import ApiCaller
+from .ArLctr import AreaLocator, Config, Match
+from .WinMgr import Frame
+
+log = logging.getLogger(__name__)
+
+
+def load_api(config: Config, win_title: str) -> ApiCaller | None:
+    """Create an ApiCaller for the window if mod data is enabled in config"""
+    mod_data = config.mod_data
+    if not mod_data.get("enabled", False):
+        return None
+    gamepath = mod_data.get("game_paths", {}).get(win_title)
+    if not gamepath:
+        log.warning(f"Game path of {win_title} not configured, mod data disabled")
+        return None
+    try:
+        return ApiCaller(gamepath=gamepath, port=int(mod_data.get("port", 0)))
+    except FileNotFoundError as e:
+        log.warning(f"Mod data disabled, {e}")
+        return None
+
+
+class StateProvider:
+    """
+    Provide game state from fresh mod data first, falling back to template matching
+    Templates ruled out by the battle status reported from the mod are never matched,
+    and in battle only the templates the bots act on are, to locate their elements
+    """
+
+    # templates possible by battle_status reported from the mod, tried before the rest
+    # the mod stays at "start" after the ship sinks, so battle end templates count too
+    battle_status_templates = {
+        "start": ["map_mode", "b_btn", "autopilot_on", "shift_btn", "f1_btn", "back_to_port_btn_2"],
+        "end": ["shift_btn", "f1_btn", "back_to_port_btn_2"],
+    }
+    # templates impossible by battle_status, "quit" is back in port
+    battle_status_excluded = {
+        "quit": ["map_mode", "b_btn", "autopilot_on", "battle_began", "shift_btn", "f1_btn"],
+    }
+
+    def __init__(self, alctr: AreaLocator, api: ApiCaller | None = None, stale: float = 10):
+        self.alctr = alctr
+        self.api = api
+        self.stale = stale  # seconds without mod updates to treat data as stale
+
+    def is_fresh(self) -> bool:
+        """Check if mod data is available and recently updated"""
+        if self.api is None:
+            return False
+        self.api.poll()
+        return time.monotonic() - self.api.updated <= self.stale
+
+    def get_state(self, screen: Frame | np.ndarray) -> Match:
+        """Get current game state as a match on screen"""
+        frame = screen if isinstance(screen, Frame) else Frame(screen)
+        status = self.api.get("battle_status") if self.is_fresh() else None  # type: ignore
+        names = self.battle_status_templates.get(status, [])  # type: ignore
+        if names:
+            match = self.alctr.match_template(frame, names)
+            if match.val >= self.alctr.config.match_threshold:
+                return match
+            if status == "start" and self.api.get("window_name") == "battle":  # type: ignore
+                # battle window with nothing to act on, no template tells more
+                return match.replace(name="battle_began")
+            log.debug(f"Battle status {status} reported by mod not confirmed")
+
+        excluded = set(names) | set(self.battle_status_excluded.get(status, []))  # type: ignore
+        if not excluded:
+            return self.alctr.match_template(frame)
+        rest = [name for name in self.alctr.config.templates if name not in excluded]
+        return self.alctr.match_template(frame, rest)
@@ -1,31 +1,89 @@
 # src/WinMgr.py
 
 import logging
-import time
+import sys
+from collections import deque
+from threading import Event
 
 import numpy as np
-import win32gui
-import win32con
-import pygetwindow as gw
 import mss
 
+try:
+    import win32gui
+    import win32con
+    import pygetwindow as gw
+except ImportError:  # not on Windows, only simulated windows are available
+    win32gui = win32con = gw = None
+
+from .Clock import Clock, default_clock
+from .PfMon import timed
+
 log = logging.getLogger(__name__)
 
 
+class Frame:
+    """
+    Captured screen whose buffer returns to its pool once no one holds the frame
+    The pool only reuses a returned buffer after all views of it are gone too
+    """
+    __slots__ = ("array", "pool", "cache")
+
+    def __init__(self, array: np.ndarray, pool: "FramePool | None" = None):
+        self.array = array
+        self.pool = pool
+        self.cache: dict = {}  # images derived from this capture
+
+    def __del__(self):
+        if self.pool is not None:
+            self.pool.release(self.array)
+
+
+class FramePool:
+    """Pool of frame buffers to capture into without allocating each time"""
+
+    def __init__(self, shape: tuple[int, int, int], size: int = 4):
+        self.shape = shape
+        self.size = size  # max free buffers kept
+        self.free: deque[np.ndarray] = deque()
+        self.allocated = 0
+
+    def acquire(self) -> Frame:
+        """Get a frame with a free buffer, contents undefined"""
+        for _ in range(len(self.free)):
+            array = self.free.popleft()
+            # views of a buffer hold a reference to it, only this name and the argument remain
+            if sys.getrefcount(array) <= 2:
+                return Frame(array, pool=self)
+            self.free.append(array)  # still read through a view, try again later
+        array = np.empty(self.shape, dtype=np.uint8)
+        self.allocated += 1
+        return Frame(array, pool=self)
+
+    def release(self, array: np.ndarray):
+        """Return buffer of a dropped frame"""
+        if len(self.free) < self.size:
+            self.free.append(array)
+
+
 class WindowManager:
     region: tuple[int, int, int, int]
-    window: gw.Win32Window
+    window: "gw.Win32Window"
 
-    def __init__(self, region: tuple[int, int, int, int], window: gw.Win32Window):
+    def __init__(self, region: tuple[int, int, int, int], window: "gw.Win32Window",
+                 event: Event | None = None, clock: Clock | None = None):
         if len(region) != 4 or not all(isinstance(x, int) for x in region):
             raise ValueError("region must be 4-int list")
         self.region = region
         self.window = window
+        self.event_stop = event  # interrupts capture delay
+        self.clock = clock or default_clock
+        _, _, w, h = region
+        self.pool = FramePool(shape=(h, w, 3))
         log.info(f"Initialized window: {self.window.title}")
 
     def set_window_borderless(self):
         self.window.activate()
-        time.sleep(1)  # wait for activation
+        self.clock.sleep(1)  # wait for activation
         hwnd = win32gui.FindWindow(None, self.window.title)
         if not hwnd:
             raise RuntimeError("Not found window")
@@ -42,8 +100,9 @@ class WindowManager:
         x, y, w, h = self.region
         win32gui.SetWindowPos(hwnd, win32con.HWND_TOP, x, y, w, h, win32con.SWP_SHOWWINDOW)
         log.info(f"Set window {self.window.title} to borderless")
-        time.sleep(1)
+        self.clock.sleep(1)
 
+    @timed()
     def check_window(self):
         if not self.window.isActive:
             self.window.activate()
@@ -55,11 +114,19 @@ class WindowManager:
             self.window.resizeTo(w, h)
             log.info(f"Reset window {self.window.title} size")
 
-    def capture_screen(self, delay=1) -> np.ndarray:
+    def capture_screen(self, delay=1) -> Frame:
+        """Capture the region after delay, only the grab is timed"""
         self.check_window()
-        time.sleep(delay)
+        self.clock.sleep(delay, event=self.event_stop)
+        return self.grab()
+
+    @timed()
+    def grab(self) -> Frame:
         x, y, w, h = self.region
         monitor = {"top": y, "left": x, "width": w, "height": h}
         with mss.mss() as sct:
-            img = np.array(sct.grab(monitor))
-        return img[:, :, :3]  # BGR without alpha
\ No newline at end of file
+            shot = sct.grab(monitor)
+        bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+        frame = self.pool.acquire()
+        np.copyto(frame.array, bgra[:, :, :3])  # BGR without alpha
+        return frame
\ No newline at end of file
@@ -0,0 +1,201 @@
+# tools/bench_perception.py
+"""
+Offline benchmark of perception hot paths over a recorded frame corpus
+
+The corpus is a directory of screenshots at the configured region size with a
+labels.json mapping file names to expected results, e.g.
+    {"port_001.png": {"state": "battle_btn"},
+     "battle_001.png": {"state": "autopilot_on", "enemies": 3, "compass": true}}
+"state" is the template expected from a full scan ("unknown" for none),
+"enemies" the number of enemies on minimap and "compass" whether it is readable.
+
+Run from the repository root:
+    python -m tools.bench_perception frames/ --lang en_us --output bench.json
+    python -m tools.bench_perception frames/ --lang en_us --compare bench.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+try:
+    import psutil  # installed with ultralytics
+except ImportError:
+    psutil = None
+
+from src.ArLctr import AreaLocator
+
+log = logging.getLogger(__name__)
+
+
+def load_corpus(path: str) -> list[tuple[str, np.ndarray, dict]]:
+    """Load frames and their labels from corpus directory"""
+    labels_path = os.path.join(path, "labels.json")
+    if not os.path.exists(labels_path):
+        raise FileNotFoundError(f"'labels.json' not found at {labels_path}")
+    with open(labels_path, "r", encoding="utf-8") as f:
+        labels: dict[str, dict] = json.load(f)
+
+    corpus = []
+    for name, label in sorted(labels.items()):
+        frame = cv2.imread(os.path.join(path, name), cv2.IMREAD_COLOR)
+        if frame is None:
+            log.warning(f"Frame {name} not found")
+            continue
+        corpus.append((name, frame, label))
+    return corpus
+
+
+def get_title(lang: str) -> str:
+    """Get a window title of language from user.json"""
+    with open(os.path.join("resources", "user.json"), "r", encoding="utf-8") as f:
+        user = json.load(f)
+    for title, title_lang in user["title_lang_map"].items():
+        if title_lang == lang:
+            return title
+    raise ValueError(f"No window title for language {lang}")
+
+
+class Bench:
+    """Time and check each perception stage over the corpus"""
+
+    def __init__(self, arlctr: AreaLocator, repeat: int):
+        self.arlctr = arlctr
+        self.repeat = repeat
+        self.samples: dict[str, list[float]] = {}
+        self.checks: dict[str, list[bool]] = {}
+
+    def _run(self, stage: str, func, *args, **kwargs):
+        result = None
+        samples = self.samples.setdefault(stage, [])
+        for i in range(self.repeat):
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            samples.append(time.perf_counter() - start)
+        return result
+
+    def _check(self, stage: str, ok: bool):
+        self.checks.setdefault(stage, []).append(ok)
+
+    def run(self, corpus: list[tuple[str, np.ndarray, dict]]):
+        for name, frame, label in corpus:
+            state = label.get("state")
+            match = self._run("match_template.full", self.arlctr.match_template, frame)
+            if state is not None:
+                self._check("match_template.full", match.name == state)
+                if state != "unknown":
+                    match = self._run("match_template.targeted", self.arlctr.match_template,
+                                      frame, [state])
+                    self._check("match_template.targeted", match.name == state)
+
+            self._run("read_bigmap", self.arlctr.read_bigmap, frame)
+
+            data = self._run("read_minimap", self.arlctr.read_minimap, frame)
+            if "enemies" in label:
+                enemies = len(data.get("enemy", [])) if data else 0
+                self._check("read_minimap", enemies == label["enemies"])
+
+            delta = self._run("read_compass", self.arlctr.read_compass, frame)
+            if "compass" in label:
+                self._check("read_compass", (delta is not None) == label["compass"])
+
+    def report(self) -> dict[str, dict]:
+        results = {}
+        for stage, samples in self.samples.items():
+            arr = np.array(samples) * 1000
+            checks = self.checks.get(stage, [])
+            results[stage] = {
+                "calls": len(samples),
+                "throughput": len(samples) / max(arr.sum() / 1000, 1e-9),  # calls per second
+                "mean": float(arr.mean()),
+                "p50": float(np.percentile(arr, 50)),
+                "p95": float(np.percentile(arr, 95)),
+                "p99": float(np.percentile(arr, 99)),
+                "accuracy": sum(checks) / len(checks) if checks else None,
+            }
+        return results
+
+
+def measure_memory(arlctr: AreaLocator, corpus: list[tuple[str, np.ndarray, dict]]) -> dict[str, int]:
+    """
+    Memory over an untimed pass of the corpus, tracemalloc slows every call down
+    Python heap is traced, native memory of OpenCV and torch only shows in process RSS
+    """
+    process = psutil.Process() if psutil else None
+    rss_base = rss_peak = process.memory_info().rss if process else 0
+    bench = Bench(arlctr=arlctr, repeat=1)
+    tracemalloc.start()
+    for item in corpus:
+        bench.run([item])
+        if process:
+            rss_peak = max(rss_peak, process.memory_info().rss)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"peak_traced": peak, "rss_base": rss_base, "rss_peak": rss_peak}
+
+
+def get_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: dict[str, dict], base: dict[str, dict] | None = None):
+    print(f"{'stage':<26}{'calls':>7}{'ops/s':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'acc':>7}"
+          + ("  p50 vs base" if base else ""))
+    for stage, r in results.items():
+        acc = "-" if r["accuracy"] is None else f"{r['accuracy']:.2f}"
+        line = (f"{stage:<26}{r['calls']:>7}{r['throughput']:>10.1f}"
+                f"{r['p50']:>9.2f}{r['p95']:>9.2f}{r['p99']:>9.2f}{acc:>7}")
+        if base and stage in base and base[stage]["p50"] > 0:
+            line += f"  {(r['p50'] / base[stage]['p50'] - 1) * 100:+.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark perception over recorded frames")
+    parser.add_argument("corpus", help="directory of frames with labels.json")
+    parser.add_argument("--lang", default="en_us", help="language of templates")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each call per frame")
+    parser.add_argument("--output", help="write results json to compare branches")
+    parser.add_argument("--compare", help="results json of a base branch")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    corpus = load_corpus(args.corpus)
+    arlctr = AreaLocator(win_title=get_title(args.lang))
+
+    memory = measure_memory(arlctr, corpus)  # first, to see allocations of a cold start
+    bench = Bench(arlctr=arlctr, repeat=args.repeat)
+    bench.run(corpus)
+
+    results = bench.report()
+    base = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            base = json.load(f)["results"]
+    print_results(results, base)
+    line = f"frames {len(corpus)}, peak traced memory {memory['peak_traced'] / 2**20:.1f} MiB"
+    if psutil:
+        line += (f", process RSS {memory['rss_peak'] / 2**20:.1f} MiB "
+                 f"({(memory['rss_peak'] - memory['rss_base']) / 2**20:+.1f} MiB over the pass)")
+    print(line)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"revision": get_revision(), "frames": len(corpus), "repeat": args.repeat,
+                       "peak_memory": memory["peak_traced"], "rss_peak": memory["rss_peak"],
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
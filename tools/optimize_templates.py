@@ -0,0 +1,202 @@
+# tools/optimize_templates.py
+"""
+Crop templates to the smallest part that still tells their state apart
+
+Uses the labeled corpus of tools.bench_perception, frames captured at the
+base_resolution of config.json. For each template with frames of its state,
+the template is shrunk from its edges while it still matches all frames of its
+state at the same place above match_threshold, and scores on all other frames
+stay below match_threshold - margin. With --mask, pixels that change between
+frames of its state are masked out. Results are written to
+resources/templates/<lang>/optimized/ and preferred by AreaLocator, e.g.
+    python -m tools.optimize_templates frames/ --lang en_us --mask
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+
+import cv2
+import numpy as np
+
+from src.ArLctr import Area, load_config, load_optimized_meta
+from tools.bench_perception import load_corpus
+
+log = logging.getLogger(__name__)
+
+
+class Optimizer:
+    """Search the smallest separating crop of one template"""
+
+    def __init__(self, image: np.ndarray, area: Area, positives: list[np.ndarray],
+                 negatives: list[np.ndarray], threshold: float, margin: float, min_size: int = 8):
+        self.image = image
+        self.area = area
+        self.positives = [frame[area.roi] for frame in positives]
+        self.negatives = [frame[area.roi] for frame in negatives]
+        self.threshold = threshold
+        self.margin = margin
+        self.min_size = min_size  # pixels of the smallest crop side
+        self.locs: list[tuple[int, int]] = []  # full template locations in positives
+
+    def _scores(self, rois: list[np.ndarray], templ: np.ndarray,
+                mask: np.ndarray | None) -> list[tuple[float, tuple[int, int]]]:
+        scores = []
+        for roi in rois:
+            result = cv2.matchTemplate(roi, templ, cv2.TM_CCOEFF_NORMED, mask=mask)
+            result = np.nan_to_num(result, nan=0.0, posinf=0.0, neginf=0.0)
+            _, val_max, _, loc_max = cv2.minMaxLoc(result)
+            scores.append((val_max, loc_max))
+        return scores
+
+    def evaluate(self, rect: tuple[int, int, int, int],
+                 mask: np.ndarray | None = None) -> tuple[bool, float, float]:
+        """Check a crop, return (valid, min score on positives, max score on negatives)"""
+        x, y, w, h = rect
+        templ = self.image[y:y + h, x:x + w]
+        pos = self._scores(self.positives, templ, mask)
+        neg = self._scores(self.negatives, templ, mask)
+        pos_min = min(v for v, _ in pos)
+        neg_max = max((v for v, _ in neg), default=-1.0)
+        same = all(abs(lx - x - fx) <= 1 and abs(ly - y - fy) <= 1
+                   for (_, (lx, ly)), (fx, fy) in zip(pos, self.locs))
+        valid = same and pos_min >= self.threshold and neg_max < self.threshold - self.margin
+        return valid, pos_min, neg_max
+
+    def baseline(self) -> tuple[bool, float, float]:
+        """Check the full template and record its locations"""
+        h, w = self.image.shape[:2]
+        self.locs = [loc for _, loc in self._scores(self.positives, self.image, None)]
+        return self.evaluate((0, 0, w, h))
+
+    def shrink(self) -> tuple[int, int, int, int]:
+        """Greedily cut edges while the crop stays valid, coarse steps first"""
+        h, w = self.image.shape[:2]
+        rect = (0, 0, w, h)
+        for ratio in (0.25, 0.1, 0.03):
+            while True:
+                x, y, cw, ch = rect
+                best = None
+                for side in range(4):
+                    step = max(1, int((cw if side % 2 == 0 else ch) * ratio))
+                    if side == 0:
+                        cand = (x + step, y, cw - step, ch)
+                    elif side == 1:
+                        cand = (x, y + step, cw, ch - step)
+                    elif side == 2:
+                        cand = (x, y, cw - step, ch)
+                    else:
+                        cand = (x, y, cw, ch - step)
+                    if cand[2] < self.min_size or cand[3] < self.min_size:
+                        continue
+                    valid, pos_min, neg_max = self.evaluate(cand)
+                    if valid and (best is None or cand[2] * cand[3] < best[0][2] * best[0][3]):
+                        best = (cand, pos_min - neg_max)
+                if best is None:
+                    break
+                rect = best[0]
+        return rect
+
+    def stable_mask(self, rect: tuple[int, int, int, int], tolerance: float) -> np.ndarray | None:
+        """Mask of crop pixels that stay the same in all frames of the state"""
+        if len(self.positives) < 2:
+            return None
+        x, y, w, h = rect
+        patches = np.stack([roi[fy + y:fy + y + h, fx + x:fx + x + w].astype(np.float32)
+                            for roi, (fx, fy) in zip(self.positives, self.locs)])
+        spread = patches.std(axis=0).max(axis=2)
+        mask = np.where(spread <= tolerance, 255, 0).astype(np.uint8)
+        if mask.mean() >= 255 or mask.mean() < 255 * 0.5:
+            return None  # nothing to mask, or too little left to match
+        return mask
+
+
+def timeit(roi: np.ndarray, templ: np.ndarray, mask: np.ndarray | None, repeat: int) -> float:
+    """Return best seconds of a match"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cv2.matchTemplate(roi, templ, cv2.TM_CCOEFF_NORMED, mask=mask)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crop templates to their separating part")
+    parser.add_argument("corpus", help="directory of frames with labels.json")
+    parser.add_argument("--lang", default="en_us", help="language of templates")
+    parser.add_argument("--margin", type=float, default=0.15, help="score gap below threshold on other states")
+    parser.add_argument("--mask", action="store_true", help="mask pixels changing between frames of a state")
+    parser.add_argument("--tolerance", type=float, default=8, help="pixel spread kept by mask")
+    parser.add_argument("--min-size", type=int, default=8, help="pixels of the smallest crop side")
+    parser.add_argument("--min-speedup", type=float, default=1.1, help="speedup to keep an optimized template")
+    parser.add_argument("--repeat", type=int, default=10, help="runs to time each match")
+    parser.add_argument("--dry-run", action="store_true", help="only report, write nothing")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    config = load_config(os.path.join("resources", "config.json"))
+    if config.template_scale != 1:
+        raise ValueError("Set region to base_resolution, templates are optimized at base resolution")
+    corpus = load_corpus(args.corpus)
+    templates_path = os.path.join("resources", "templates", args.lang)
+    output_path = os.path.join(templates_path, "optimized")
+    meta = load_optimized_meta(output_path)
+
+    print(f"{'template':<20} {'size':>8} {'crop':>16} {'mask':>5} {'pos min':>8} {'neg max':>8} {'speedup':>8}")
+    for name, spec in config.templates.items():
+        image = cv2.imread(os.path.join(templates_path, f"{name}.png"), cv2.IMREAD_COLOR)
+        if image is None:
+            continue
+        positives = [frame for _, frame, label in corpus if label.get("state") == name]
+        negatives = [frame for _, frame, label in corpus if label.get("state") != name]
+        if not positives:
+            log.info(f"Template {name} skipped, no frames of its state")
+            continue
+
+        opt = Optimizer(image, spec.area, positives, negatives, config.match_threshold,
+                        args.margin, args.min_size)
+        valid, pos_min, neg_max = opt.baseline()
+        if not valid:
+            log.warning(f"Template {name} does not separate as is, "
+                        f"positive min {pos_min:.3f}, negative max {neg_max:.3f}")
+            continue
+
+        rect = opt.shrink()
+        mask = opt.stable_mask(rect, args.tolerance) if args.mask else None
+        if mask is not None and not opt.evaluate(rect, mask)[0]:
+            mask = None
+        _, pos_min, neg_max = opt.evaluate(rect, mask)
+
+        x, y, w, h = rect
+        crop = image[y:y + h, x:x + w]
+        speedup = (timeit(opt.positives[0], image, None, args.repeat) /
+                   timeit(opt.positives[0], crop, mask, args.repeat))
+        size = f"{image.shape[1]}x{image.shape[0]}"
+        print(f"{name:<20} {size:>8} {str(list(rect)):>16} {'yes' if mask is not None else 'no':>5} "
+              f"{pos_min:>8.3f} {neg_max:>8.3f} {speedup:>7.2f}x")
+
+        if args.dry_run:
+            continue
+        if speedup < args.min_speedup:
+            log.info(f"Template {name} kept as is, speedup {speedup:.2f}x below {args.min_speedup}x")
+            meta.pop(name, None)
+            continue
+        os.makedirs(output_path, exist_ok=True)
+        cv2.imwrite(os.path.join(output_path, f"{name}.png"), crop)
+        if mask is not None:
+            cv2.imwrite(os.path.join(output_path, f"{name}_mask.png"), mask)
+        meta[name] = {"offset": [x, y], "size": [image.shape[1], image.shape[0]],
+                      "mask": mask is not None, "speedup": round(speedup, 2)}
+
+    if not args.dry_run and meta:
+        os.makedirs(output_path, exist_ok=True)
+        with open(os.path.join(output_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        print(f"Optimized templates written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
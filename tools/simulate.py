@@ -0,0 +1,86 @@
+# tools/simulate.py
+"""
+End-to-end run of MainController against simulated games
+
+Reports simulated battles per hour, port turnaround and stuck-state rate so
+that every change of the bot can be measured without the game. With --virtual
+bot time only moves on sleeps, so hours of play run in minutes, e.g.
+    python -m tools.simulate --duration 300 --battle 30
+    python -m tools.simulate --duration 7200 --virtual
+    python -m tools.simulate --duration 600 --instances 2 --drop-rate 0.1 --output sim.json
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+
+from src.Clock import Clock, VirtualClock
+from src.HkMgr import HotkeyManager
+from src.Sim import DURATIONS, SimController
+
+log = logging.getLogger(__name__)
+
+
+def run(mctrl: SimController, hkmgr: HotkeyManager, clock: Clock, duration: float) -> list[dict]:
+    """Run controller for duration seconds of clock and return stats of each game"""
+    thread = threading.Thread(target=mctrl.run, name="MainController", daemon=True)
+    start = clock.monotonic()
+    hkmgr.script_start()
+    thread.start()
+    while clock.monotonic() - start < duration and thread.is_alive():
+        time.sleep(0.1)
+    stats = [game.stats() for game in mctrl.games]
+    hkmgr.script_exit()
+    mctrl.stop_event.set()
+    thread.join(timeout=30)
+    return stats
+
+
+def print_stats(stats: list[dict]):
+    """Print stats of each game and total"""
+    for i, s in enumerate(stats):
+        turnaround = s["port_turnaround"]
+        turnaround = f"{turnaround:.1f}s" if turnaround is not None else "-"
+        print(f"instance {i}: {s['battles']} battles in {s['elapsed']:.0f}s, "
+              f"{s['battles_per_hour']:.1f}/h, port turnaround {turnaround}, "
+              f"stuck {s['stuck']} ({s['stuck_rate']:.1%}), now in {s['stage']}")
+    if len(stats) > 1:
+        total = sum(s["battles_per_hour"] for s in stats)
+        print(f"total: {total:.1f} battles/h")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot end to end against simulated games")
+    parser.add_argument("--duration", type=float, default=300, help="seconds to run")
+    parser.add_argument("--lang", default="en_us", help="language of templates")
+    parser.add_argument("--instances", type=int, default=1, help="number of simulated games")
+    parser.add_argument("--queue", type=float, default=DURATIONS["queue"], help="seconds in queue")
+    parser.add_argument("--loading", type=float, default=DURATIONS["loading"], help="seconds of loading")
+    parser.add_argument("--battle", type=float, default=DURATIONS["battle"], help="seconds of a battle")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="chance of a click lost")
+    parser.add_argument("--stuck-timeout", type=float, default=60, help="seconds over a stage to count stuck")
+    parser.add_argument("--schedule", action="store_true", help="follow scheduled tasks of user.json")
+    parser.add_argument("--seed", type=int, help="seed of simulated games")
+    parser.add_argument("--virtual", action="store_true", help="run on virtual time instead of wall time")
+    parser.add_argument("--output", help="write stats json")
+    parser.add_argument("--log-level", default="WARNING", help="logging level")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+
+    hkmgr = HotkeyManager()
+    clock = VirtualClock() if args.virtual else Clock()
+    mctrl = SimController(hkmgr, lang=args.lang, instances=args.instances, schedule=args.schedule, clock=clock,
+                          durations={"queue": args.queue, "loading": args.loading, "battle": args.battle},
+                          drop_rate=args.drop_rate, stuck_timeout=args.stuck_timeout, seed=args.seed)
+    stats = run(mctrl, hkmgr, clock, args.duration)
+    print_stats(stats)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "stats": stats}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# tools/suggest_areas.py
+"""
+Print tightened template areas from the match history of adaptive_areas
+
+Enable "adaptive_areas" in config.json, run the bot for a while, then
+    python -m tools.suggest_areas
+to print the suggested areas in config.json units, ready to paste.
+"""
+
+import argparse
+import json
+import logging
+import os
+
+from src.ArLctr import AreaTracker, load_config
+
+log = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Suggest tightened template areas from match history")
+    parser.add_argument("--history", help="history json, path of adaptive_areas by default")
+    parser.add_argument("--margin", type=int, help="pixels around hits, margin of adaptive_areas by default")
+    parser.add_argument("--min-hits", type=int, help="hits to suggest an area")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    config = load_config(os.path.join("resources", "config.json"))
+    tracker = AreaTracker()
+    options = {**config.adaptive_areas, "enabled": True}
+    if args.history:
+        options["path"] = args.history
+    if args.margin is not None:
+        options["margin"] = args.margin
+    if args.min_hits is not None:
+        options["min_hits"] = args.min_hits
+    tracker.configure(region=(config.region.w, config.region.h), **options)
+    if not tracker.stats:
+        print(f"No match history of region {config.region.w}x{config.region.h} at {tracker.path}")
+        return
+
+    areas = {name: spec.area for name, spec in config.templates.items()}
+    suggested = tracker.suggest(areas)
+
+    # back to pixels of base resolution used in config.json
+    sx = config.base_resolution[0] / config.region.w
+    sy = config.base_resolution[1] / config.region.h
+
+    print(f"{'template':<20} {'hits':>6} {'misses':>6} {'configured':>22} {'suggested':>22} {'cost':>6}")
+    snippet = {}
+    for name, stat in sorted(tracker.stats.items()):
+        if name not in areas:
+            continue
+        area = areas[name]
+        tight = suggested.get(name)
+        configured = f"{list(area)}"
+        if tight is None:
+            print(f"{name:<20} {stat['hits']:>6} {stat['misses']:>6} {configured:>22} {'-':>22}")
+            continue
+        base = [round(tight.x * sx), round(tight.y * sy), round(tight.w * sx), round(tight.h * sy)]
+        snippet[name] = base
+        cost = tight.w * tight.h / (area.w * area.h)
+        print(f"{name:<20} {stat['hits']:>6} {stat['misses']:>6} {configured:>22} {str(list(tight)):>22} {cost:>6.0%}")
+
+    if snippet:
+        print("\nSuggested \"area\" of templates in config.json:")
+        for name, area in snippet.items():
+            print(f"    {json.dumps(name)}: {json.dumps(area)},")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# tools/train_classifier.py
+"""
+Train the state classifier on a labeled corpus and export it to ONNX
+
+Uses the corpus of tools.bench_perception, the "state" of each frame is the
+class. The network sees the whole frame downscaled, AreaLocator then confirms
+its top_k states by template matching, see "classifier" in config.json, e.g.
+    python -m tools.train_classifier frames/ --epochs 40
+writes resources/models/state_classifier.onnx and its labels in a .json sidecar.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import torch
+from torch import nn
+
+from src.ArLctr import StateClassifier, load_config
+from tools.bench_perception import load_corpus
+
+log = logging.getLogger(__name__)
+
+
+class TinyNet(nn.Module):
+    """Four strided convolutions and a linear head, keeps the layout of the screen"""
+
+    def __init__(self, size: tuple[int, int], classes: int):
+        super().__init__()
+        layers = []
+        channels = 3
+        for out in (16, 32, 64, 64):
+            layers += [nn.Conv2d(channels, out, 3, stride=2, padding=1),
+                       nn.BatchNorm2d(out), nn.ReLU(inplace=True)]
+            channels = out
+        layers += [nn.Conv2d(channels, 16, 1), nn.ReLU(inplace=True), nn.Flatten()]
+        self.features = nn.Sequential(*layers)
+        with torch.no_grad():
+            n = self.features(torch.zeros(1, 3, size[1], size[0])).shape[1]
+        self.head = nn.Sequential(nn.Dropout(0.2), nn.Linear(n, classes))
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.head(self.features(x))
+
+
+def augment(x: torch.Tensor, shift: int) -> torch.Tensor:
+    """Random small shifts and brightness changes of a batch"""
+    if shift:
+        dx, dy = np.random.randint(-shift, shift + 1, size=2)
+        x = torch.roll(x, shifts=(int(dy), int(dx)), dims=(2, 3))
+    gain = torch.empty(x.shape[0], 1, 1, 1).uniform_(0.85, 1.15)
+    return (x * gain).clamp(0, 1)
+
+
+def evaluate(model: nn.Module, x: torch.Tensor, y: torch.Tensor, top_k: int) -> tuple[float, float]:
+    """Top-1 and top-k accuracy"""
+    if len(y) == 0:
+        return float("nan"), float("nan")
+    model.eval()
+    with torch.no_grad():
+        logits = model(x)
+    top = logits.topk(min(top_k, logits.shape[1]), dim=1).indices
+    top1 = (top[:, 0] == y).float().mean().item()
+    topk = (top == y[:, None]).any(dim=1).float().mean().item()
+    return top1, topk
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the state classifier and export it to ONNX")
+    parser.add_argument("corpus", help="directory of frames with labels.json")
+    parser.add_argument("--width", type=int, default=128, help="input width, height keeps base_resolution aspect")
+    parser.add_argument("--epochs", type=int, default=30, help="training epochs")
+    parser.add_argument("--batch", type=int, default=32, help="batch size")
+    parser.add_argument("--lr", type=float, default=1e-3, help="learning rate")
+    parser.add_argument("--val", type=float, default=0.2, help="fraction of frames held out")
+    parser.add_argument("--shift", type=int, default=2, help="pixels of random shift in training")
+    parser.add_argument("--seed", type=int, default=0, help="seed of split and training")
+    parser.add_argument("--output", default=os.path.join("resources", "models", "state_classifier.onnx"),
+                        help="path of the ONNX model")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    config = load_config(os.path.join("resources", "config.json"))
+    bw, bh = config.base_resolution
+    size = (args.width, max(8, round(args.width * bh / bw)))
+    top_k = config.classifier.top_k
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+
+    corpus = [(name, frame, label["state"]) for name, frame, label in load_corpus(args.corpus)
+              if label.get("state") is not None]
+    labels = sorted({state for _, _, state in corpus})
+    if len(labels) < 2:
+        raise ValueError(f"Need frames of at least 2 states, got {labels}")
+    unknown = [state for state in labels if state != "unknown" and state not in config.templates]
+    if unknown:
+        log.warning(f"States {unknown} are no templates of config.json, never confirmed")
+    missing = [name for name in config.templates if name not in labels]
+    if missing:
+        log.info(f"Templates without frames, only found by full scan: {missing}")
+
+    x = torch.from_numpy(np.stack([StateClassifier.preprocess(frame, size) for _, frame, _ in corpus]))
+    y = torch.tensor([labels.index(state) for _, _, state in corpus])
+    order = torch.randperm(len(y))
+    n_val = int(len(y) * args.val)
+    val_idx, train_idx = order[:n_val], order[n_val:]
+    print(f"{len(train_idx)} training and {n_val} validation frames of {len(labels)} states, input {size[0]}x{size[1]}")
+
+    # weight rare states up, frames of some states are far more common
+    counts = torch.bincount(y[train_idx], minlength=len(labels)).clamp(min=1).float()
+    model = TinyNet(size, len(labels))
+    loss_fn = nn.CrossEntropyLoss(weight=counts.sum() / counts / len(labels))
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=1e-4)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs)
+
+    for epoch in range(1, args.epochs + 1):
+        model.train()
+        total = 0.0
+        for batch in train_idx[torch.randperm(len(train_idx))].split(args.batch):
+            optimizer.zero_grad()
+            loss = loss_fn(model(augment(x[batch], args.shift)), y[batch])
+            loss.backward()
+            optimizer.step()
+            total += loss.item() * len(batch)
+        scheduler.step()
+        if epoch % 5 == 0 or epoch == args.epochs:
+            top1, topk = evaluate(model, x[val_idx], y[val_idx], top_k)
+            print(f"epoch {epoch:>3}  loss {total / len(train_idx):.4f}  "
+                  f"val top-1 {top1:.1%}  top-{top_k} {topk:.1%}")
+
+    model.eval()
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    torch.onnx.export(model, x[:1], args.output, input_names=["input"], output_names=["logits"],
+                      dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}}, dynamo=False)
+    top1, topk = evaluate(model, x[val_idx], y[val_idx], top_k)
+    meta = {"labels": labels, "size": list(size), "top1": round(top1, 4), f"top{top_k}": round(topk, 4)}
+    with open(os.path.splitext(args.output)[0] + ".json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    print(f"Model written to {args.output}")
+
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        log.warning("onnxruntime not installed, exported model not checked")
+        return
+    session = ort.InferenceSession(args.output, providers=["CPUExecutionProvider"])
+    sample = x[:1].numpy()
+    best = float("inf")
+    for _ in range(20):
+        start = time.perf_counter()
+        logits = session.run(None, {"input": sample})[0]
+        best = min(best, time.perf_counter() - start)
+    with torch.no_grad():
+        diff = float(np.abs(logits - model(x[:1]).numpy()).max())
+    print(f"ONNX inference {best * 1e3:.3f} ms per frame, max diff to torch {diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()